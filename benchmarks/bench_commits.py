@@ -0,0 +1,94 @@
+"""Count the database commits made by each /ndp endpoint.
+
+Run inside a CKAN test environment with:
+
+    pytest --ckan-ini=test.ini -s benchmarks/bench_commits.py
+
+Each endpoint is called twice: first when the user (or the organization
+and membership) it needs does not exist yet, then again once it does. The commit counts are printed as a
+table and checked against the single-transaction budget.
+"""
+import pytest
+from sqlalchemy import event
+
+import ckan.model as model
+
+import ckanext.ndpcatalogadditions.controller as controller
+
+
+USER_INFO = {
+    'username': 'bench.user@example.org',
+    'email': 'bench.user@example.org',
+    'name': 'Bench User',
+    'given_name': 'Bench',
+    'family_name': 'User',
+    'roles': [],
+}
+
+AUTH = {'Authorization': 'Bearer benchmark-token'}
+
+# endpoint -> (commits on first call, commits on repeat call)
+COMMIT_BUDGET = {
+    'package_create': (1, 1),
+    'package_update': (1, 1),
+    'my_package_list': (1, 0),
+    'package_delete': (1, 1),
+}
+
+
+class CommitCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, session):
+        self.count += 1
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    monkeypatch.setattr(controller, 'get_user_info', lambda token: dict(USER_INFO))
+    counter = CommitCounter()
+    event.listen(model.Session, 'after_commit', counter)
+    yield counter
+    event.remove(model.Session, 'after_commit', counter)
+
+
+def call(app, commits, endpoint, data=None):
+    commits.count = 0
+    url = f'/ndp/{endpoint}'
+    response = app.post(url, json=data or {}, headers=AUTH)
+    assert response.status_code == 200, response.body
+    return commits.count
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_commits_per_endpoint(app, commits):
+    results = {}
+    name = 'bench-dataset'
+
+    # the first call creates the local user
+    results['my_package_list'] = (
+        call(app, commits, 'my_package_list'),
+        call(app, commits, 'my_package_list'),
+    )
+    # the first call creates the organization and the membership
+    results['package_create'] = (
+        call(app, commits, 'package_create', {'name': name, 'owner_org': 'Bench Org'}),
+        call(app, commits, 'package_create', {'name': name + '-2', 'owner_org': 'Bench Org'}),
+    )
+    results['package_update'] = (
+        call(app, commits, 'package_update', {'id': name, 'name': name, 'owner_org': 'Bench Org'}),
+        call(app, commits, 'package_update', {'id': name, 'name': name, 'owner_org': 'Bench Org'}),
+    )
+    results['package_delete'] = (
+        call(app, commits, 'package_delete', {'id': name}),
+        call(app, commits, 'package_delete', {'id': name + '-2'}),
+    )
+
+    print('\nendpoint           first  repeat')
+    for endpoint, (first, repeat) in results.items():
+        print(f'{endpoint:<18} {first:>5}  {repeat:>6}')
+
+    for endpoint, budget in COMMIT_BUDGET.items():
+        assert results[endpoint] == budget, endpoint
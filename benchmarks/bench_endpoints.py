@@ -0,0 +1,202 @@
+"""Latency, throughput and upstream cost of every /ndp endpoint.
+
+Run inside a CKAN test environment with:
+
+    pytest --ckan-ini=test.ini -s benchmarks/bench_endpoints.py
+
+Keycloak and the production CKAN are replaced by local stubs
+(`tests/stub_keycloak.py`, `tests/stub_ckan.py`), so no network access is
+needed. Tokens are real RS256 tokens verified against the stub's JWKS.
+Every endpoint is called BENCH_REQUESTS times (default 50) from
+BENCH_CONCURRENCY threads (default 4), with BENCH_LATENCY seconds (default
+0.005) added to every stub response. Datasets the calls need are created
+before the timed part.
+
+For each endpoint the results give p50/p95/p99 latency, throughput, and
+production, Keycloak and database commits per request. They are printed as
+a table and written as JSON to BENCH_OUTPUT (default
+benchmarks/results/endpoints.json); `benchmarks/compare.py` diffs two such
+files.
+"""
+import concurrent.futures
+import json
+import os
+import platform
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+import ckan.model as model
+
+import ckanext.ndpcatalogadditions.controller as controller
+from ckanext.ndpcatalogadditions.tests.stub_ckan import StubCkan
+from ckanext.ndpcatalogadditions.tests.stub_keycloak import StubKeycloak
+
+
+REQUESTS = int(os.getenv('BENCH_REQUESTS', '50'))
+CONCURRENCY = int(os.getenv('BENCH_CONCURRENCY', '4'))
+LATENCY = float(os.getenv('BENCH_LATENCY', '0.005'))
+OUTPUT = os.getenv('BENCH_OUTPUT', os.path.join(os.path.dirname(__file__), 'results', 'endpoints.json'))
+
+ORGANIZATION = 'Bench Org'
+BATCH_SIZE = 10
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+class CommitCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, session):
+        with self._lock:
+            self.count += 1
+
+
+class Client:
+    def __init__(self, app, token):
+        self.app = app
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def call(self, method, endpoint, payload=None):
+        url = f'/ndp/{endpoint}'
+        if method == 'GET':
+            response = self.app.get(url, query_string=payload or {}, headers=self.headers)
+        else:
+            response = self.app.post(url, json=payload or {}, headers=self.headers)
+        assert response.status_code < 300, (endpoint, response.status_code, response.get_data(as_text=True))
+        return response
+
+
+def dataset(i, prefix):
+    return {'name': f'bench-{prefix}-{i}', 'title': f'Bench {prefix} {i}', 'owner_org': ORGANIZATION,
+            'notes': 'Benchmark dataset',
+            'resources': [{'url': f'https://example.org/{prefix}/{i}.csv', 'name': 'data', 'format': 'CSV'}]}
+
+
+def scenarios(submitter, reviewer):
+    """(endpoint, method, client, prepare(i) -> payload) for every /ndp endpoint."""
+    def created(prefix):
+        def prepare(i):
+            submitter.call('POST', 'package_create', dataset(i, prefix))
+            return {'id': dataset(i, prefix)['name']}
+        return prepare
+
+    def created_batch(prefix):
+        def prepare(i):
+            ids = []
+            for j in range(BATCH_SIZE):
+                submitter.call('POST', 'package_create', dataset(i * BATCH_SIZE + j, prefix))
+                ids.append(dataset(i * BATCH_SIZE + j, prefix)['name'])
+            return {'ids': ids}
+        return prepare
+
+    def queued_approval(i):
+        payload = created('status')(i)
+        response = reviewer.call('POST', 'package_approve', dict(payload, **{'async': True}))
+        return {'job_id': response.json['job_id']}
+
+    def updated(i):
+        payload = created('update')(i)
+        return dict(dataset(i, 'update'), id=payload['id'], notes='Updated benchmark dataset')
+
+    return [
+        ('package_create', 'POST', submitter, lambda i: dataset(i, 'create')),
+        ('package_create_batch', 'POST', submitter,
+         lambda i: {'datasets': [dataset(i * BATCH_SIZE + j, 'create-batch') for j in range(BATCH_SIZE)]}),
+        ('package_update', 'POST', submitter, updated),
+        ('my_package_list', 'GET', submitter, lambda i: {}),
+        ('review_queue', 'GET', reviewer, lambda i: {}),
+        ('package_approve', 'POST', reviewer, created('approve')),
+        ('package_approve_batch', 'POST', reviewer, created_batch('approve-batch')),
+        ('approval_status', 'GET', reviewer, queued_approval),
+        ('package_delete', 'POST', submitter, created('delete')),
+        ('package_purge', 'POST', submitter, created('purge')),
+        ('package_reject', 'POST', reviewer, created('reject')),
+        ('package_reject_batch', 'POST', reviewer, created_batch('reject-batch')),
+        ('upstream_status', 'GET', reviewer, lambda i: {}),
+        ('metrics', 'GET', reviewer, lambda i: {}),
+    ]
+
+
+def run(endpoint, method, client, payloads, production, keycloak, commits):
+    production_calls = len(production.requests)
+    keycloak_calls = len(keycloak.requests)
+    commits.count = 0
+
+    def timed(payload):
+        start = time.perf_counter()
+        client.call(method, endpoint, payload)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        latencies = list(executor.map(timed, payloads))
+    elapsed = time.perf_counter() - start
+
+    n = len(payloads)
+    return {
+        'requests': n,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput_rps': n / elapsed,
+        'production_calls_per_request': (len(production.requests) - production_calls) / n,
+        'keycloak_calls_per_request': (len(keycloak.requests) - keycloak_calls) / n,
+        'commits_per_request': commits.count / n,
+    }
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    with StubCkan(latency=LATENCY) as production, StubKeycloak(latency=LATENCY) as keycloak:
+        monkeypatch.setenv('CKANEXT__KEYCLOAK__SERVER_URL', keycloak.url)
+        monkeypatch.setenv('CKANEXT__KEYCLOAK__REALM_NAME', keycloak.realm)
+        monkeypatch.setattr(controller, 'ckan_url', production.url)
+        yield production, keycloak
+
+
+@pytest.fixture
+def commits():
+    counter = CommitCounter()
+    event.listen(model.Session, 'after_commit', counter)
+    yield counter
+    event.remove(model.Session, 'after_commit', counter)
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_endpoints(app, stubs, commits, migrate_db_for):
+    migrate_db_for('ndpcatalogadditions')
+    production, keycloak = stubs
+    submitter = Client(app, keycloak.token('bench.submitter@example.org'))
+    reviewer = Client(app, keycloak.token('bench.reviewer@example.org', roles=sorted(controller.reviewer_roles)))
+
+    results = {}
+    for endpoint, method, client, prepare in scenarios(submitter, reviewer):
+        payloads = [prepare(i) for i in range(REQUESTS)]
+        results[endpoint] = run(endpoint, method, client, payloads, production, keycloak, commits)
+
+    print('\nendpoint               p50 ms  p95 ms  p99 ms   req/s  remote/req  commits/req')
+    for endpoint, r in results.items():
+        remote = r['production_calls_per_request'] + r['keycloak_calls_per_request']
+        print(f"{endpoint:<22} {r['p50_ms']:>6.1f}  {r['p95_ms']:>6.1f}  {r['p99_ms']:>6.1f}  "
+              f"{r['throughput_rps']:>6.1f}  {remote:>10.2f}  {r['commits_per_request']:>11.2f}")
+
+    os.makedirs(os.path.dirname(OUTPUT), exist_ok=True)
+    with open(OUTPUT, 'w') as f:
+        json.dump({
+            'config': {'requests': REQUESTS, 'concurrency': CONCURRENCY, 'latency': LATENCY,
+                       'batch_size': BATCH_SIZE, 'python': platform.python_version()},
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
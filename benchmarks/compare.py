@@ -0,0 +1,65 @@
+"""Compare two result files written by bench_endpoints.py.
+
+    python benchmarks/compare.py baseline.json current.json [--threshold 0.2]
+
+Prints the relative change of every metric per endpoint and exits with
+status 1 when a latency or per-request cost grew, or the throughput
+dropped, by more than the threshold (default 20%).
+"""
+import argparse
+import json
+import sys
+
+
+# metrics where a higher value is worse; throughput is the other way round
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'production_calls_per_request',
+                   'keycloak_calls_per_request', 'commits_per_request')
+HIGHER_IS_BETTER = ('throughput_rps',)
+
+
+def change(before, after):
+    if before == after:
+        return 0.0
+    if not before:
+        return float('inf')
+    return (after - before) / before
+
+
+def compare(baseline, current, threshold):
+    regressions = []
+    rows = []
+    for endpoint, after in sorted(current['results'].items()):
+        before = baseline['results'].get(endpoint)
+        if before is None:
+            rows.append((endpoint, 'new', '', '', ''))
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            delta = change(before[metric], after[metric])
+            worse = delta > threshold if metric in LOWER_IS_BETTER else delta < -threshold
+            if worse:
+                regressions.append((endpoint, metric))
+            rows.append((endpoint, metric, f'{before[metric]:.2f}', f'{after[metric]:.2f}',
+                         f'{delta:+.0%}' + ('  REGRESSION' if worse else '')))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows, regressions = compare(baseline, current, args.threshold)
+    for row in rows:
+        print(f'{row[0]:<22} {row[1]:<30} {row[2]:>10} {row[3]:>10}  {row[4]}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import datetime
+
+from sqlalchemy import MetaData, Table, Column, types
+
+import ckan.model as model
+
+
+# steps of an approval in the order they complete
+APPROVAL_STEPS = (
+    'new',
+    'remote_user_ensured',
+    'remote_org_ensured',
+    'membership_ensured',
+    'remote_dataset_requested',
+    'remote_dataset_created',
+    'files_transferred',
+    'local_dataset_deleted',
+)
+
+# the extension's own tables, created by its migrations (ckan db upgrade -p ndpcatalogadditions)
+metadata = MetaData()
+
+approval_state_table = Table(
+    'ndp_approval_state', metadata,
+    Column('dataset_id', types.UnicodeText, primary_key=True),
+    Column('state', types.UnicodeText, nullable=False),
+    Column('remote_user_name', types.UnicodeText),
+    Column('remote_org_id', types.UnicodeText),
+    # the Prekan organization remote_org_id was resolved for
+    Column('local_org_id', types.UnicodeText),
+    Column('remote_dataset_id', types.UnicodeText),
+    Column('remote_dataset_name', types.UnicodeText),
+    # JSON content hashes of the fields and resources last sent to production
+    Column('content_hashes', types.UnicodeText),
+    Column('updated', types.DateTime),
+)
+
+FIELDS = [c.name for c in approval_state_table.columns if c.name != 'dataset_id']
+
+
+def approval_states(dataset_ids):
+    """Return {dataset_id: state} for the given datasets that have a checkpoint."""
+    rows = model.Session.query(approval_state_table.c.dataset_id, approval_state_table.c.state).filter(
+        approval_state_table.c.dataset_id.in_(list(dataset_ids))
+    )
+    return {dataset_id: state for dataset_id, state in rows}
+
+
+class ApprovalCheckpoint:
+    """Persisted progress of one dataset's approval.
+
+    Each completed step is recorded together with the production ids it
+    produced, so a retried approval can resume after the last completed
+    step instead of repeating remote work.
+    """
+
+    def __init__(self, dataset_id, row=None):
+        self.dataset_id = dataset_id
+        self.exists = row is not None
+        self.data = dict(row) if row is not None else {'state': 'new'}
+
+    @classmethod
+    def load(cls, dataset_id):
+        row = model.Session.execute(
+            approval_state_table.select().where(approval_state_table.c.dataset_id == dataset_id)
+        ).first()
+        if row is not None:
+            row = {field: getattr(row, field) for field in FIELDS}
+        return cls(dataset_id, row)
+
+    @property
+    def state(self):
+        return self.data['state']
+
+    def reached(self, step):
+        return APPROVAL_STEPS.index(self.state) >= APPROVAL_STEPS.index(step)
+
+    def rewind(self, step, commit=True):
+        """Move the checkpoint back to `step`, e.g. when a remote call is known to have had no effect."""
+        if self.reached(step) and self.state != step:
+            self.data['state'] = step
+            self.advance(step, commit=commit)
+
+    def advance(self, step, commit=True, **fields):
+        """Record `step` as completed along with any ids it produced.
+
+        With `commit=False` the row is only written to the session and is
+        committed by whatever commits next (e.g. the local package_delete).
+        """
+        self.data.update(fields)
+        if not self.reached(step):
+            self.data['state'] = step
+        self.data['updated'] = datetime.datetime.utcnow()
+        values = {field: self.data.get(field) for field in FIELDS}
+        if self.exists:
+            model.Session.execute(
+                approval_state_table.update()
+                .where(approval_state_table.c.dataset_id == self.dataset_id)
+                .values(**values)
+            )
+        else:
+            model.Session.execute(approval_state_table.insert().values(dataset_id=self.dataset_id, **values))
+            self.exists = True
+        if commit:
+            model.Session.commit()
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+# seconds remote production IDs are trusted before they are looked up again
+remote_cache_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REMOTE_CACHE_TTL', '600'))
+remote_cache_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REMOTE_CACHE_SIZE', '10000'))
+
+# 'memory' keeps every cache in the worker process; 'redis' shares them between all workers
+cache_backend = os.getenv('CKANEXT__NDPCATALOGADDITIONS__CACHE_BACKEND', 'memory')
+
+# Redis used by the 'redis' backend and, whichever the backend, to broadcast invalidations
+cache_redis_url = os.getenv('CKANEXT__NDPCATALOGADDITIONS__CACHE_REDIS_URL') or os.getenv('CKAN_REDIS_URL')
+
+INVALIDATION_CHANNEL = 'ndp:cache:invalidate'
+
+
+class TTLCache:
+    """Thread-safe in-process cache whose entries expire after `ttl` seconds.
+
+    Once `maxsize` entries are stored the least recently used one is evicted.
+    """
+
+    def __init__(self, ttl=remote_cache_ttl, maxsize=remote_cache_size):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    return json.loads(data)
+
+
+class RedisCache:
+    """Cache shared by every worker, stored in Redis under `ndp:<namespace>:`.
+
+    Values are stored as compact JSON and expire with the namespace's `ttl`
+    (or the one given to `set`). Redis errors never fail the caller: a read
+    counts as a miss and a failed write is only logged.
+    """
+
+    def __init__(self, client, namespace, ttl=remote_cache_ttl):
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.prefix = f'ndp:{namespace}:'
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return self.prefix + (key if isinstance(key, str) else json.dumps(key, separators=(',', ':')))
+
+    def _failed(self):
+        self.errors += 1
+        traceback.print_exc()
+
+    def get(self, key):
+        try:
+            data = self.client.get(self._key(key))
+        except Exception:
+            self._failed()
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            if ttl <= 0:
+                self.client.delete(self._key(key))
+            else:
+                self.client.set(self._key(key), dumps(value), px=max(1, int(ttl * 1000)))
+        except Exception:
+            self._failed()
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except Exception:
+            self._failed()
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(match=self.prefix + '*', count=1000))
+            for start in range(0, len(keys), 1000):
+                self.client.delete(*keys[start:start + 1000])
+        except Exception:
+            self._failed()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'backend': 'redis',
+        }
+
+
+_redis_client = None
+_caches = {}
+invalidation_hooks = []
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def redis_client():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(cache_redis_url or 'redis://localhost:6379/0')
+    return _redis_client
+
+
+def set_redis_client(client):
+    """Use `client` (e.g. a fakeredis instance) for the shared caches and invalidations."""
+    global _redis_client
+    _redis_client = client
+
+
+def get_cache(namespace, ttl=remote_cache_ttl, maxsize=remote_cache_size, backend=None):
+    """Return the cache for `namespace`, in memory or in Redis depending on `cache_backend`.
+
+    Every namespace has its own TTL. Caches are registered by namespace so
+    that `invalidate` can reach them.
+    """
+    if (backend or cache_backend) == 'redis':
+        cache = RedisCache(redis_client(), namespace, ttl)
+    else:
+        cache = TTLCache(ttl=ttl, maxsize=maxsize)
+    _caches[namespace] = cache
+    return cache
+
+
+def shared_cache(namespace, ttl=remote_cache_ttl):
+    """Return a Redis cache for `namespace`, or None when caches are kept in memory.
+
+    For caches that already keep a local copy and only need one shared
+    between workers on top of it.
+    """
+    if cache_backend != 'redis':
+        return None
+    cache = RedisCache(redis_client(), namespace, ttl)
+    _caches.setdefault(namespace, cache)
+    return cache
+
+
+def on_invalidate(callback):
+    """Register `callback(namespace, key)`, called in every worker when an entry is invalidated."""
+    invalidation_hooks.append(callback)
+    return callback
+
+
+def _drop(namespace, key):
+    cache = _caches.get(namespace)
+    if cache is not None:
+        cache.delete(key)
+    for callback in invalidation_hooks:
+        try:
+            callback(namespace, key)
+        except Exception:
+            traceback.print_exc()
+
+
+def invalidate(namespace, key):
+    """Drop `key` from a cache in this worker and, through Redis pub/sub, in every other one.
+
+    Used when a user, organization or membership changes, so that no worker
+    keeps serving the old entry until its TTL runs out.
+    """
+    _drop(namespace, key)
+    if cache_redis_url or cache_backend == 'redis':
+        try:
+            redis_client().publish(INVALIDATION_CHANNEL, dumps([namespace, key]))
+        except Exception:
+            traceback.print_exc()
+
+
+def _listen(pubsub):
+    for message in pubsub.listen():
+        if message.get('type') != 'message':
+            continue
+        try:
+            namespace, key = loads(message['data'])
+        except (ValueError, TypeError):
+            continue
+        _drop(namespace, tuple(key) if isinstance(key, list) else key)
+
+
+def start_invalidation_listener():
+    """Subscribe this worker to invalidations published by the others.
+
+    Cheap to call on every request; the listener thread is only started
+    once per process (after any fork), and only when Redis is configured.
+    """
+    global _listener
+    if not (cache_redis_url or cache_backend == 'redis'):
+        return
+    if _listener is not None and _listener.is_alive():
+        return
+    with _listener_lock:
+        if _listener is not None and _listener.is_alive():
+            return
+        try:
+            pubsub = redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+        except Exception:
+            traceback.print_exc()
+            return
+        _listener = threading.Thread(target=_listen, args=(pubsub,), name='ndp-cache-invalidation', daemon=True)
+        _listener.start()
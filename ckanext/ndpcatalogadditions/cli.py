@@ -1,5 +1,18 @@
+import collections
+import json
+import os
+
 import click
 
+import ckan.model as model
+import ckan.logic as logic
+
+from ckanext.ndp.search import iter_search, solr_date
+from ckanext.ndp.controller import (approve_datasets, load_dataset_for_approval, prepare_remote_dataset,
+                                    production, ckan_url)
+from ckanext.ndp.approval_state import approval_state_table
+from ckanext.ndp.reconcile import index_document, iter_remote, reconcile
+
 
 @click.group(short_help="ndpcatalogadditions CLI.")
 def ndpcatalogadditions():
@@ -16,5 +29,233 @@ def command(name):
     click.echo("Hello, {name}!".format(name=name))
 
 
+# higher capacities win when collapsing duplicate memberships
+CAPACITY_RANK = {'admin': 3, 'editor': 2, 'member': 1}
+
+
+@ndpcatalogadditions.command("dedupe-members")
+@click.option("--dry-run", is_flag=True, help="Only report the duplicate rows.")
+def dedupe_members(dry_run):
+    """Remove duplicate user membership rows.
+
+    Keeps the highest-capacity active row for each (organization, user)
+    pair and deletes the others.
+    """
+    members = model.Session.query(model.Member).filter(
+        model.Member.table_name == 'user',
+        model.Member.state == 'active'
+    ).order_by(model.Member.group_id, model.Member.table_id)
+
+    kept = {}
+    duplicates = []
+    for member in members.yield_per(1000):
+        key = (member.group_id, member.table_id)
+        current = kept.get(key)
+        if current is None:
+            kept[key] = member
+        elif CAPACITY_RANK.get(member.capacity, 0) > CAPACITY_RANK.get(current.capacity, 0):
+            duplicates.append(current)
+            kept[key] = member
+        else:
+            duplicates.append(member)
+
+    click.echo(f"Found {len(duplicates)} duplicate membership rows.")
+    if dry_run or not duplicates:
+        return
+
+    for member in duplicates:
+        model.Session.delete(member)
+    model.Session.commit()
+    click.echo(f"Deleted {len(duplicates)} duplicate membership rows.")
+
+
+def promote_filters(organizations, creators, since, until):
+    """Return the Solr filter query selecting the datasets to promote."""
+    filters = []
+    if organizations:
+        filters.append('organization:(' + ' OR '.join(json.dumps(o) for o in organizations) + ')')
+    if creators:
+        creator_ids = []
+        for name in creators:
+            user = model.User.get(name)
+            if user is None:
+                raise click.BadParameter(f"Unknown user '{name}'", param_hint='--creator')
+            creator_ids.append(user.id)
+        filters.append('creator_user_id:(' + ' OR '.join(json.dumps(i) for i in creator_ids) + ')')
+    if since or until:
+        start = solr_date(since.isoformat()) if since else '*'
+        end = solr_date(until.isoformat()) if until else '*'
+        filters.append(f'metadata_created:[{start} TO {end}]')
+    return ' AND '.join(filters)
+
+
+def read_checkpoint(path):
+    """Return the ids already promoted according to a checkpoint file."""
+    promoted = set()
+    if not path or not os.path.exists(path):
+        return promoted
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by an interruption
+                continue
+            if entry.get('success'):
+                promoted.add(entry['id'])
+    return promoted
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@ndpcatalogadditions.command("promote")
+@click.option("-o", "--organization", "organizations", multiple=True,
+              help="Only datasets of this organization (name). Can be repeated.")
+@click.option("-c", "--creator", "creators", multiple=True,
+              help="Only datasets created by this user (name). Can be repeated.")
+@click.option("--since", type=click.DateTime(), help="Only datasets created at or after this date.")
+@click.option("--until", type=click.DateTime(), help="Only datasets created at or before this date.")
+@click.option("--concurrency", type=int,
+              help="Datasets pushed to production at the same time "
+                   "(default: CKANEXT__NDPCATALOGADDITIONS__APPROVE_BATCH_WORKERS).")
+@click.option("--batch-size", type=int, default=100, show_default=True,
+              help="Datasets selected and approved per round.")
+@click.option("--checkpoint", default="ndp-promote.jsonl", show_default=True,
+              help="File recording every promoted dataset; a new run skips those already done.")
+@click.option("--dry-run", is_flag=True, help="Print what would be sent to production and stop.")
+def promote(organizations, creators, since, until, concurrency, batch_size, checkpoint, dry_run):
+    """Promote Prekan datasets to the production catalog.
+
+    Datasets are selected by organization, creator and creation date and
+    approved exactly like /ndp/package_approve does, several at a time. Each
+    result is appended to the checkpoint file as it completes, so an
+    interrupted run can simply be started again.
+    """
+    site_user = logic.get_action('get_site_user')({'ignore_auth': True}, {})
+    context = {'user': site_user['name']}
+    search_dict = {'q': '*:*', 'include_private': True}
+    fq = promote_filters(organizations, creators, since, until)
+    if fq:
+        search_dict['fq'] = fq
+
+    promoted = read_checkpoint(checkpoint)
+    total = logic.get_action('package_search')(context, dict(search_dict, rows=0))['count']
+    matching = (package['id'] for package in iter_search(
+        context, search_dict, batch_size, fields=['id'], sort_field='metadata_created', descending=False))
+
+    if dry_run:
+        count = 0
+        for dataset_id in (i for i in matching if i not in promoted):
+            dataset, checkpoint_state = load_dataset_for_approval(dataset_id)
+            # the organization is only looked up in production on a real run
+            organization = dataset.get('organization') or {}
+            remote_dataset = prepare_remote_dataset(dataset, {'id': organization['name']} if organization else None)
+            click.echo(json.dumps({'id': dataset_id, 'state': checkpoint_state.state, 'dataset': remote_dataset}))
+            count += 1
+        click.echo(f"{count} datasets would be promoted.", err=True)
+        return
+
+    succeeded = failed = skipped = 0
+    with open(checkpoint, 'a') as log, \
+            click.progressbar(length=total, label='Promoting datasets', file=click.get_text_stream('stderr')) as bar:
+        # the bar counts every matching dataset, including those the checkpoint file skips
+        for batch in batches(matching, batch_size):
+            selected = [dataset_id for dataset_id in batch if dataset_id not in promoted]
+            skipped += len(batch) - len(selected)
+            results = approve_datasets(selected, workers=concurrency) if selected else []
+            for result in results:
+                log.write(json.dumps({'id': result['id'], 'success': result['success'],
+                                      'error': result.get('error'),
+                                      'remote_id': (result.get('result') or {}).get('id')}) + '\n')
+                if result['success']:
+                    succeeded += 1
+                else:
+                    failed += 1
+            log.flush()
+            os.fsync(log.fileno())
+            bar.update(len(batch))
+
+    click.echo(f"Promoted {succeeded} datasets, {failed} failed, {skipped} skipped from the checkpoint.")
+    if failed:
+        raise click.exceptions.Exit(1)
+
+
+def iter_approved(context, organizations, rows):
+    """Yield the approved datasets as search documents ordered by name, one page at a time.
+
+    They are read from the database rather than the search index: approval
+    deletes the local dataset, and CKAN drops deleted datasets from the index
+    (ckan.search.remove_deleted_packages defaults to true).
+    """
+    # Solr sorts names by code point, so the database must too for the two streams to merge
+    name = model.Package.name.collate('C')
+    query = model.Session.query(model.Package.id, model.Package.name).join(
+        approval_state_table, approval_state_table.c.dataset_id == model.Package.id
+    ).filter(approval_state_table.c.state != 'new')
+    if organizations:
+        query = query.join(model.Group, model.Group.id == model.Package.owner_org).filter(
+            model.Group.name.in_(organizations))
+
+    show_context = dict(context, ignore_auth=True, use_cache=False)
+    last_name = None
+    while True:
+        page = query if last_name is None else query.filter(name > last_name)
+        packages = page.order_by(name).limit(rows).all()
+        for package_id, _ in packages:
+            yield index_document(logic.get_action('package_show')(dict(show_context), {'id': package_id}))
+        if len(packages) < rows:
+            return
+        last_name = packages[-1].name
+
+
+@ndpcatalogadditions.command("reconcile")
+@click.option("-o", "--organization", "organizations", multiple=True,
+              help="Only datasets of this organization (name). Can be repeated.")
+@click.option("--rows", type=int, default=1000, show_default=True,
+              help="Datasets fetched per search page from each catalog.")
+@click.option("--all", "show_all", is_flag=True, help="Also print the datasets that match.")
+def reconcile_catalogs(organizations, rows, show_all):
+    """Compare approved Prekan datasets with the production catalog.
+
+    Both catalogs are paged through by name, the approved datasets from
+    the database and production with only the compared index fields, and
+    each dataset's normalized metadata is hashed. Prints one
+    JSON line per dataset that is missing from production, only in
+    production ("extra") or changed, and exits with status 1 if any is.
+    """
+    site_user = logic.get_action('get_site_user')({'ignore_auth': True}, {})
+    context = {'user': site_user['name']}
+    fq = promote_filters(organizations, (), None, None)
+
+    local = iter_approved(context, organizations, rows)
+    remote = iter_remote(production, ckan_url, fq, rows)
+
+    counts = collections.Counter()
+    for status, local_document, remote_document in reconcile(local, remote):
+        counts[status] += 1
+        if status != 'same' or show_all:
+            document = local_document or remote_document
+            click.echo(json.dumps({
+                'status': status,
+                'name': document['name'],
+                'local_id': local_document and local_document['id'],
+                'remote_id': remote_document and remote_document['id'],
+            }))
+
+    click.echo(', '.join(f"{counts[status]} {status}" for status in ('same', 'changed', 'missing', 'extra')),
+               err=True)
+    if counts['changed'] or counts['missing'] or counts['extra']:
+        raise click.exceptions.Exit(1)
+
+
 def get_commands():
     return [ndpcatalogadditions]
@@ -1,18 +1,38 @@
 
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
 import os
 import random
 import string
+import threading
+import time
 import traceback
-import requests
 import json
+from types import SimpleNamespace
 
 import ckan.model as model
 import ckan.logic as logic
 from ckan.plugins import toolkit
 from ckan.authz import is_sysadmin
 from ckan.lib.munge import munge_title_to_name
+from ckan.lib import uploader
+from ckan.lib import search
 from ckanext.ndp.keycloak_token import get_user_info
-from flask import request, jsonify
+from ckanext.ndp.http_client import HttpClient
+from ckanext.ndp.cache import get_cache, invalidate
+from ckanext.ndp.jobs import get_approval_queue
+from ckanext.ndp.approval_state import ApprovalCheckpoint
+from ckanext.ndp.sync import dataset_hashes, field_hashes, content_hash, plan_sync
+from ckanext.ndp.transfer import transfer_files
+from ckanext.ndp.upstream import get_breaker, breaker_metrics, deadline, current_deadline, UpstreamUnavailable
+from ckanext.ndp.search import search_page, iter_search, index_notifications_suppressed, index_without_commit
+from ckanext.ndp.metrics import (registry, timed, phase, request_seconds, requests_total,
+                                 request_errors_total, ckan_action_seconds)
+from flask import request, jsonify, Response, stream_with_context, g
+from sqlalchemy import event, func, inspect, or_
+from sqlalchemy.exc import IntegrityError
 
 
 server_url = os.getenv('CKANEXT__KEYCLOAK__REDIRECT_URI')
@@ -25,61 +45,318 @@ headers = {
     'Content-Type': 'application/json'
 }
 
+# shared pooled client for every call to the production catalog
+production = HttpClient(headers=headers, breaker=get_breaker('production_ckan'), name='production_ckan')
+
+# production catalog lookups reused across approvals:
+#    username -> remote user, organization name -> remote organization,
+#    (remote organization id, username) -> True once the user is an editor
+remote_users = get_cache('remote_users')
+remote_organizations = get_cache('remote_organizations')
+remote_memberships = get_cache('remote_memberships')
+
+# 'admin' creates approved datasets with the admin API key; 'creator' creates them
+# as their creator with a per-creator API token reused for creator_token_ttl seconds
+remote_token_mode = os.getenv('CKANEXT__NDPCATALOGADDITIONS__REMOTE_TOKEN_MODE', 'admin')
+creator_token_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__CREATOR_TOKEN_TTL', '3600'))
+# production expires the tokens this long after the cache stops handing them out
+creator_token_grace = 300
+# credentials: kept in the worker's memory only, never in the shared Redis backend
+creator_tokens = get_cache('creator_tokens', ttl=creator_token_ttl, backend='memory')
+creator_token_locks = {}
+creator_token_locks_guard = threading.Lock()
+
+# seconds an approval may spend on remote calls before it gives up
+approve_deadline = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVE_DEADLINE', '60'))
+
+# threads shared by all requests for production lookups that run side by side
+remote_fanout_workers = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REMOTE_FANOUT_WORKERS', '16'))
+remote_executor = concurrent.futures.ThreadPoolExecutor(max_workers=remote_fanout_workers,
+                                                        thread_name_prefix='ndp-remote')
+
+# /ndp/review_queue: page size, its upper bound, default fields and seconds facet counts are cached
+review_queue_rows = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REVIEW_QUEUE_ROWS', '50'))
+review_queue_max_rows = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REVIEW_QUEUE_MAX_ROWS', '500'))
+REVIEW_QUEUE_FIELDS = ['id', 'name', 'title', 'organization', 'creator_user_id', 'private',
+                       'num_resources', 'metadata_created', 'metadata_modified']
+review_queue_facet_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REVIEW_QUEUE_FACET_TTL', '30'))
+review_queue_facet_cache = get_cache('review_queue_facets', ttl=review_queue_facet_ttl, maxsize=100)
+
+# maximum number of datasets in one /ndp/package_create_batch request
+create_batch_max_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__CREATE_BATCH_MAX_SIZE', '10000'))
+
+# /ndp/package_reject_batch: maximum ids per request, datasets per database transaction
+# and ids per search index delete query
+reject_batch_max_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__REJECT_BATCH_MAX_SIZE', '1000'))
+purge_chunk_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__PURGE_CHUNK_SIZE', '50'))
+search_delete_chunk_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__SEARCH_DELETE_CHUNK_SIZE', '500'))
+
+# page size and its upper bound for /ndp/my_package_list
+my_package_list_rows = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__MY_PACKAGE_LIST_ROWS', '1000'))
+my_package_list_max_rows = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__MY_PACKAGE_LIST_MAX_ROWS', '1000'))
+
+# user id -> validator of that user's /ndp/my_package_list, dropped when the user's datasets change
+# through /ndp; the TTL bounds staleness for changes made elsewhere
+package_list_validator_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__PACKAGE_LIST_VALIDATOR_TTL', '60'))
+package_list_validators = get_cache('package_list_validators', ttl=package_list_validator_ttl)
+
+# when set, /ndp/package_approve enqueues a background job instead of approving inline
+approve_async = toolkit.asbool(os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVE_ASYNC', 'false'))
+
+# concurrent production writes and maximum number of datasets for /ndp/package_approve_batch
+approve_batch_workers = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVE_BATCH_WORKERS', '8'))
+approve_batch_max_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVE_BATCH_MAX_SIZE', '500'))
+
+
+# Keycloak realm roles that grant reviewer or sysadmin rights on the /ndp endpoints,
+# and usernames that are reviewers whatever their roles
+reviewer_roles = {r.strip() for r in os.getenv(
+    'CKANEXT__NDPCATALOGADDITIONS__REVIEWER_ROLES', 'ndp-reviewer').split(',') if r.strip()}
+sysadmin_roles = {r.strip() for r in os.getenv(
+    'CKANEXT__NDPCATALOGADDITIONS__SYSADMIN_ROLES', 'ndp-sysadmin').split(',') if r.strip()}
+reviewer_usernames = {u.strip() for u in os.getenv(
+    'CKANEXT__NDPCATALOGADDITIONS__REVIEWERS',
+    'klin_sdsc_edu,segurvich_sdsc_edu,kbolaughlin_ucsd_edu,jjl053_ucsd_edu,pkarmakar_ucsd_edu',
+).split(',') if u.strip()}
+
+# username -> whether the local user is a CKAN sysadmin, for callers without a reviewer role
+sysadmin_flag_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__SYSADMIN_FLAG_TTL', '60'))
+sysadmin_flags = get_cache('sysadmin_flags', ttl=sysadmin_flag_ttl)
+
 
 def generate_random_password(length=32):
     characters = string.ascii_letters + string.digits + string.punctuation
     return ''.join(random.choice(characters) for i in range(length))
 
 
-def is_reviewer(username):
-    return username in [ "klin_sdsc_edu", "segurvich_sdsc_edu", "kbolaughlin_ucsd_edu", "jjl053_ucsd_edu", "pkarmakar_ucsd_edu" ] 
+def is_reviewer(username, roles=()):
+    return username in reviewer_usernames or not reviewer_roles.isdisjoint(roles)
 
 
-def get_or_create_user():
+def bearer_token():
     # Get the Authorization header
     auth_header = request.headers.get('Authorization')
 
     # Extract the Bearer Token if the header exists
     if auth_header and auth_header.startswith('Bearer '):
-        bearer_token = auth_header[len('Bearer '):]
-    else:
-        raise ValueError('Missing or invalid KeyCloak token')
+        return auth_header[len('Bearer '):]
+    raise ValueError('Missing or invalid KeyCloak token')
+
+
+def local_username(user_info):
+    return user_info['username'].replace('.', '_').replace('@', '_')
+
+
+def can_review(user_info=None):
+    """Return whether the caller may review datasets, without creating their user.
+
+    Reviewer and sysadmin realm roles are read from the (cached) token claims,
+    so granting or revoking them in Keycloak applies from the caller's next
+    token. Only callers with neither role cost a read of their local sysadmin
+    flag, which is itself cached for `sysadmin_flag_ttl` seconds.
+    """
+    if user_info is None:
+        user_info = get_user_info(bearer_token())
+    roles = user_info.get('roles') or ()
+    username = local_username(user_info)
+    if not sysadmin_roles.isdisjoint(roles) or is_reviewer(username, roles):
+        return True
+
+    sysadmin = sysadmin_flags.get(username)
+    if sysadmin is None:
+        user = model.User.get(username)
+        sysadmin = bool(user and user.sysadmin)
+        sysadmin_flags.set(username, sysadmin)
+    return sysadmin
+
+
+def get_or_create(query, create):
+    """Return the object found by `query`, creating it with `create` if needed.
+
+    The new row is only flushed, inside a savepoint, so it becomes part of
+    the request's single transaction and is committed by the CKAN action
+    (or `commit_pending_writes`). If a concurrent request inserted the same
+    row first, the savepoint is rolled back and the existing row returned.
+    """
+    obj = query()
+    if obj:
+        return obj
+    try:
+        with model.Session.begin_nested():
+            obj = create()
+            model.Session.add(obj)
+    except IntegrityError:
+        obj = query()
+        if not obj:
+            raise
+        return obj
+    model.Session.info['ndp_pending_writes'] = True
+    return obj
+
+
+def commit_pending_writes():
+    # commit rows flushed by get_or_create when no CKAN action committed them
+    if model.Session.info.pop('ndp_pending_writes', False):
+        model.Session.commit()
+
+
+def call_action(name, context, data_dict):
+    with timed(ckan_action_seconds, name):
+        return logic.get_action(name)(context, data_dict)
+
+
+def get_or_create_user():
+    user_info = get_user_info(bearer_token())
+    with phase('user_resolution'):
+        return get_or_create_local_user(user_info)
+
+
+def get_or_create_local_user(user_info):
+    username = local_username(user_info)
 
-    user_info = get_user_info(bearer_token)
-    username = user_info['username'].replace('.', '_').replace('@', '_')
-    user = model.User.get(username)
-    if not user:
-        # Create a new user
+    def create_user():
         user = model.User(name=username, email=user_info['email'])
         user.fullname = user_info['name']
         user.password = generate_random_password()
         user.state = model.State.ACTIVE
-        model.Session.add(user)
-        model.Session.commit()
-    return user
+        return user
+
+    return get_or_create(lambda: model.User.get(username), create_user)
+
+
+# (user id, organization id) -> capacity of memberships already known to exist
+membership_cache_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__MEMBERSHIP_CACHE_SIZE', '10000'))
+membership_cache_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__MEMBERSHIP_CACHE_TTL', '30'))
+membership_cache = get_cache('memberships', ttl=membership_cache_ttl, maxsize=membership_cache_size)
+
+
+# attributes of a membership and of a user that the cached entries depend on
+MEMBER_ACCESS_ATTRIBUTES = ('capacity', 'state')
+USER_ACCESS_ATTRIBUTES = ('sysadmin', 'state')
+
+
+def access_changed(obj, attributes):
+    attrs = inspect(obj).attrs
+    return any(attrs[name].history.has_changes() for name in attributes)
+
+
+def collect_access_changes(session, flush_context):
+    # remember the memberships and users whose access changed in this transaction; other
+    # updates, such as the last_active time CKAN writes on every request, are skipped
+    changes = session.info.setdefault('ndp_access_changes', set())
+    added_or_deleted = [(obj, True) for obj in list(session.new) + list(session.deleted)]
+    for obj, always in added_or_deleted + [(obj, False) for obj in session.dirty]:
+        if isinstance(obj, model.Member) and obj.table_name == 'user':
+            if always or access_changed(obj, MEMBER_ACCESS_ATTRIBUTES):
+                changes.add(('memberships', (obj.table_id, obj.group_id)))
+        elif isinstance(obj, model.User):
+            if always or access_changed(obj, USER_ACCESS_ATTRIBUTES):
+                changes.add(('sysadmin_flags', obj.name))
+
+
+def publish_access_changes(session):
+    # only once committed, so that no worker caches the old row again in between
+    for namespace, key in session.info.pop('ndp_access_changes', ()):
+        invalidate(namespace, key)
+
+
+def discard_access_changes(session):
+    session.info.pop('ndp_access_changes', None)
+
+
+# membership and sysadmin changes made anywhere in CKAN (UI, API, CLI) drop the cached entries
+event.listen(model.Session, 'after_flush', collect_access_changes)
+event.listen(model.Session, 'after_commit', publish_access_changes)
+event.listen(model.Session, 'after_rollback', discard_access_changes)
+
+# capacities that already allow a user to create datasets in an organization
+EDITOR_CAPACITIES = ('editor', 'admin')
+
+
+def ensure_editor_membership(user, organization):
+    key = (user.id, organization.id)
+    if membership_cache.get(key) in EDITOR_CAPACITIES:
+        return
+
+    def find_member():
+        return model.Session.query(model.Member).filter(
+            model.Member.group_id == organization.id,
+            model.Member.table_id == user.id,
+            model.Member.table_name == 'user',
+            model.Member.state == 'active'
+        ).first()
+
+    member = find_member()
+    if member is None:
+        # lock the organization until commit, so concurrent first requests add one row
+        model.Session.query(model.Group).filter(model.Group.id == organization.id).with_for_update().one()
+        member = find_member()
+    if member is None:
+        member = model.Member(group=organization, table_id=user.id, table_name='user', capacity='editor')
+        model.Session.add(member)
+        model.Session.flush()
+        model.Session.info['ndp_pending_writes'] = True
+    elif member.capacity not in EDITOR_CAPACITIES:
+        member.capacity = 'editor'
+        model.Session.flush()
+        model.Session.info['ndp_pending_writes'] = True
+    else:
+        # only cache memberships that are already committed
+        membership_cache.set(key, member.capacity)
 
 
 def process_user_and_organization(user, org_name):
-    organization = model.Group.get(munge_title_to_name(org_name))
-    if not organization:
-        # Create the organization object
-        organization = model.Group(name=munge_title_to_name(org_name),
-                                   title=org_name,
-                                   description="Created by admin when creating a new dataset",
-                                   type='organization',
-                                   is_organization=True)
-        model.Session.add(organization)
-        model.Session.commit()        
-
-    member = model.Member(group=organization, table_id=user.id, table_name='user', capacity='editor')
-    model.Session.add(member)
-    model.Session.commit()   
+    org_name_munged = munge_title_to_name(org_name)
+
+    def create_organization():
+        return model.Group(name=org_name_munged,
+                           title=org_name,
+                           description="Created by admin when creating a new dataset",
+                           type='organization',
+                           is_organization=True)
+
+    with phase('organization_resolution'):
+        organization = get_or_create(lambda: model.Group.get(org_name_munged), create_organization)
+        ensure_editor_membership(user, organization)
     return organization
     
 
+def slim(remote_object):
+    # keep only what later production calls need from a remote user or organization
+    return {k: remote_object.get(k) for k in ('id', 'name', 'title')}
+
+
+def invalidate_remote_cache(username, organization_name=None):
+    invalidate('remote_users', username)
+    if organization_name:
+        remote_organization = remote_organizations.get(organization_name)
+        invalidate('remote_organizations', organization_name)
+        if remote_organization:
+            invalidate('remote_memberships', (remote_organization['id'], username))
+
+
+@contextlib.contextmanager
+def invalidate_on_failure(username, get_organization_name):
+    # a failed remote call may mean a cached production id is stale
+    try:
+        yield
+    except Exception:
+        invalidate_remote_cache(username, get_organization_name())
+        raise
+
+
 def get_or_create_remote_user(username, email, fullname):
+    remote_user = remote_users.get(username)
+    if remote_user:
+        return remote_user
+    remote_user = fetch_or_create_remote_user(username, email, fullname)
+    remote_users.set(username, slim(remote_user))
+    return remote_user
+
+
+def fetch_or_create_remote_user(username, email, fullname):
     user_show_url = f'{ckan_url}/api/3/action/user_show'
-    response = requests.get(user_show_url, headers=headers, params={'id': username})
+    response = production.get(user_show_url, params={'id': username})
     
     if response.status_code == 200:
         user_info = response.json()['result']
@@ -98,7 +375,7 @@ def get_or_create_remote_user(username, email, fullname):
         }
 
         # Make the API request
-        response = requests.post(api_url, data=json.dumps(data), headers=headers)
+        response = production.post(api_url, data=json.dumps(data))
 
         # Check the response
         if response.status_code == 200:
@@ -110,9 +387,24 @@ def get_or_create_remote_user(username, email, fullname):
         raise ValueError(f"Failed to retrieve user info: {response.text}")
 
 
-def process_remote_user_and_organization(remote_user, organization):   
+def get_remote_organization(organization):
+    remote_organization = remote_organizations.get(organization.name)
+    if not remote_organization:
+        remote_organization = get_or_create_remote_organization(organization)
+        remote_organizations.set(organization.name, slim(remote_organization))
+    return remote_organization
+
+
+def ensure_remote_editor(remote_user, remote_organization):
+    membership = (remote_organization['id'], remote_user['name'])
+    if not remote_memberships.get(membership):
+        add_remote_editor(remote_user, remote_organization)
+        remote_memberships.set(membership, True)
+
+
+def get_or_create_remote_organization(organization):
     data = { 'id': organization.name }
-    response = requests.post(f'{ckan_url}/api/3/action/organization_show', headers=headers, json=data)
+    response = production.post(f'{ckan_url}/api/3/action/organization_show', idempotent=True, json=data)
     if response.status_code == 200:
         remote_organization = response.json()['result']
     else:
@@ -122,32 +414,36 @@ def process_remote_user_and_organization(remote_user, organization):
             "title": organization.title,
             "description": organization.description
         }
-        response = requests.post(f'{ckan_url}/api/3/action/organization_create', headers=headers, json=org_data)
+        response = production.post(f'{ckan_url}/api/3/action/organization_create', json=org_data)
         if response.status_code == 200:
             remote_organization = response.json()['result']
         else:
             raise ValueError(f"Failed to create organization: {response.text}")
-    
+    return remote_organization
+
+
+def add_remote_editor(remote_user, remote_organization):
     # add the user as an editor to the remote organization
     member_data = {
         'id': remote_organization['id'],
         'username': remote_user['name'],
         'role': 'editor'
     }
-    response = requests.post(f'{ckan_url}/api/3/action/organization_member_create', headers=headers, json=member_data)
+    response = production.post(f'{ckan_url}/api/3/action/organization_member_create', idempotent=True, json=member_data)
     if response.status_code != 200:
-        raise Value(f"Failed to add user to organization: {response.text}")
-
-    return remote_organization
+        raise ValueError(f"Failed to add user to organization: {response.text}")
     
 
-def create_api_token(username):
+def create_api_token(username, expires_in=None):
     api_url = f'{ckan_url}/api/3/action/api_token_create'
     data = {
         'name': 'dataset_token',
         'user': username
     }
-    response = requests.post(api_url, data=json.dumps(data), headers=headers)
+    if expires_in:
+        # enforced by production's expire_api_token plugin; unit 1 is seconds
+        data.update(expires_in=expires_in, unit=1)
+    response = production.post(api_url, data=json.dumps(data))
     if response.status_code == 200:
         new_token = response.json()['result']['token']
         return new_token
@@ -160,25 +456,116 @@ def delete_api_token(token):
     data = {
         'token': token,
     }
-    response = requests.post(api_url, data=json.dumps(data), headers=headers)
+    response = production.post(api_url, data=json.dumps(data), idempotent=True)
     if response.status_code != 200:
-        raise ValueError(f"Error creating API token: {response.text}")
+        raise ValueError(f"Error revoking API token: {response.text}")
     
 
-def save_remote_dataset(remote_user, dataset):
-    token = create_api_token(remote_user['name'])
-    try:
-        api_url = f"{ckan_url}/api/3/action/package_create"
-        response = requests.post(api_url, data=json.dumps(dataset), headers=headers)
-        if response.status_code == 200:
-            created_package = response.json()['result']
-            return created_package
-        else:
-            raise ValueError(f"Failed to create dataset: {response.text}   {json.dumps(dataset, indent=4)}")
-    finally:
+def cached_creator_token(username):
+    entry = creator_tokens.get(username)
+    return entry['token'] if isinstance(entry, dict) else None
+
+
+def creator_token_lock(username):
+    with creator_token_locks_guard:
+        return creator_token_locks.setdefault(username, threading.Lock())
+
+
+def get_creator_token(username):
+    """Return the creator's production API token, issuing one if none is cached.
+
+    Tokens are created with an expiry, so production drops them shortly after
+    the cache does, whichever worker issued them. The cache entry holds the
+    token itself, which is also what revokes it, so it stays in this
+    worker's memory whatever the cache backend. Threads of this worker
+    issue one token per creator at a time.
+    """
+    token = cached_creator_token(username)
+    if token:
+        return token
+    with creator_token_lock(username):
+        token = cached_creator_token(username)
+        if not token:
+            token = create_api_token(username, expires_in=creator_token_ttl + creator_token_grace)
+            creator_tokens.set(username, {'token': token})
+    return token
+
+
+def revoke_creator_token(username):
+    with creator_token_lock(username):
+        token = cached_creator_token(username)
+        invalidate('creator_tokens', username)
+    if token:
         delete_api_token(token)
 
+
+class RemoteDatasetRejected(ValueError):
+    """Production answered package_create with a definite client error, so nothing was created."""
+
+
+# production extra recording the Prekan dataset a production dataset was approved from
+SOURCE_EXTRA = 'prekan_dataset_id'
+
+
+def save_remote_dataset(remote_user, dataset):
+    api_url = f"{ckan_url}/api/3/action/package_create"
+    if remote_token_mode == 'creator':
+        # create the dataset as its creator with a short-lived cached token
+        token = get_creator_token(remote_user['name'])
+        response = production.post(api_url, data=json.dumps(dataset), headers={'X-CKAN-API-Key': token})
+        if response.status_code in (401, 403):
+            revoke_creator_token(remote_user['name'])
+    else:
+        response = production.post(api_url, data=json.dumps(dataset))
+
+    if response.status_code == 200:
+        created_package = response.json()['result']
+        return created_package
+    elif 400 <= response.status_code < 500 and response.status_code != 408:
+        raise RemoteDatasetRejected(f"Failed to create dataset: {response.text}   {json.dumps(dataset, indent=4)}")
+    else:
+        raise ValueError(f"Failed to create dataset: {response.text}   {json.dumps(dataset, indent=4)}")
+
     
+def find_remote_dataset(name):
+    api_url = f"{ckan_url}/api/3/action/package_show"
+    response = production.post(api_url, idempotent=True, json={'id': name})
+    if response.status_code == 200:
+        return response.json()['result']
+    return None
+
+
+def remote_action(action, data, idempotent=False):
+    api_url = f"{ckan_url}/api/3/action/{action}"
+    response = production.post(api_url, data=json.dumps(data), idempotent=idempotent)
+    if response.status_code != 200:
+        raise ValueError(f"Failed to call {action}: {response.text}")
+    return response.json()['result']
+
+
+def package_list_validator(user_id):
+    """Cheap validator for a user's datasets: their count and latest modification time."""
+    validator = package_list_validators.get(user_id)
+    if validator is None:
+        count, modified = model.Session.query(
+            func.count(model.Package.id), func.max(model.Package.metadata_modified)
+        ).filter(model.Package.creator_user_id == user_id).one()
+        validator = f"{count}:{modified.isoformat() if modified else ''}"
+        package_list_validators.set(user_id, validator)
+    return validator
+
+
+def invalidate_package_list(*user_ids):
+    for user_id in user_ids:
+        if user_id:
+            invalidate('package_list_validators', user_id)
+
+
+def dataset_creator_id(dataset_id):
+    package = model.Package.get(dataset_id) if dataset_id else None
+    return package.creator_user_id if package else None
+
+
 def create_package():
     if request.method == 'POST':
         try:
@@ -188,8 +575,91 @@ def create_package():
                 organization = process_user_and_organization(user, dataset_dict['owner_org'])
                 dataset_dict['owner_org'] = organization.name
             context = {'user': user.name}
-            dataset = logic.get_action('package_create')(context, dataset_dict)                
+            dataset = call_action('package_create', context, dataset_dict)                
+            invalidate_package_list(user.id)
             return dataset
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
+        except Exception as e:
+            return f'Error: {str(e)}', 401
+
+    return "Method not allowed", 405  # For unsupported methods
+
+
+def read_batch_items():
+    """Yield the datasets of a batch request body.
+
+    Accepts a JSON array, {"datasets": [...]}, or an NDJSON stream (one dataset
+    per line, Content-Type application/x-ndjson) that is read line by line.
+    NDJSON lines are yielded undecoded, so that `batch_item` can report a
+    malformed line as a failure of that item only.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            if line.strip():
+                yield line
+        return
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get('datasets')
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of datasets")
+    for item in data:
+        yield item
+
+
+def batch_item(item):
+    if isinstance(item, (bytes, str)):
+        item = json.loads(item)
+    if not isinstance(item, dict):
+        raise ValueError("Expected a dataset object")
+    return item
+
+
+def create_package_batch():
+    if request.method == 'POST':
+        try:
+            user = get_or_create_user()
+            # a new user must survive the rollback of a failing dataset
+            commit_pending_writes()
+            context = {'user': user.name}
+            organizations = {}
+            results = []
+            # CKAN would index and commit Solr per dataset; index each here and commit once
+            try:
+                with index_notifications_suppressed():
+                    for index, item in enumerate(read_batch_items()):
+                        if index >= create_batch_max_size:
+                            results.append({'index': index, 'success': False,
+                                            'error': f"At most {create_batch_max_size} datasets per batch"})
+                            break
+                        try:
+                            dataset_dict = batch_item(item)
+                            if dataset_dict.get('owner_org'):
+                                org_name = dataset_dict['owner_org']
+                                if org_name not in organizations:
+                                    organizations[org_name] = process_user_and_organization(user, org_name).name
+                                dataset_dict['owner_org'] = organizations[org_name]
+                            dataset = call_action('package_create', dict(context), dataset_dict)
+                            index_without_commit(dataset['id'])
+                            results.append({'index': index, 'success': True, 'id': dataset['id'],
+                                            'name': dataset['name']})
+                        except UpstreamUnavailable:
+                            raise
+                        except Exception as e:
+                            model.Session.rollback()
+                            organizations.clear()
+                            error = e.error_dict if isinstance(e, logic.ValidationError) else str(e)
+                            results.append({'index': index, 'success': False, 'error': error})
+            finally:
+                if any(result['success'] for result in results):
+                    search.commit()
+            invalidate_package_list(user.id)
+            return {'results': results}
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             return f'Error: {str(e)}', 401
 
@@ -205,8 +675,13 @@ def update_package():
                 organization = process_user_and_organization(user, dataset_dict['owner_org'])
                 dataset_dict['owner_org'] = organization.name
             context = {'user': user.name}
-            result = logic.get_action('package_update')(context, dataset_dict)
+            creator_id = dataset_creator_id(dataset_dict.get('id'))
+            result = call_action('package_update', context, dataset_dict)
+            invalidate_package_list(user.id, creator_id)
             return result
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             return f'Error: {str(e)}', 401
 
@@ -219,8 +694,13 @@ def delete_package():
             user = get_or_create_user()
             dataset_dict = request.get_json()            
             context = {'user': user.id}
-            logic.get_action('package_delete')(context, dataset_dict)
+            creator_id = dataset_creator_id(dataset_dict.get('id'))
+            call_action('package_delete', context, dataset_dict)
+            invalidate_package_list(user.id, creator_id)
             return f"The package '{dataset_dict['id']}' is deleted."
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             return f'Error: {str(e)}', 401
 
@@ -233,16 +713,35 @@ def purge_package():
             user = get_or_create_user()
             dataset_dict = request.get_json()
             context = {'user': user.id}
-            logic.get_action('dataset_purge')(context, dataset_dict)
+            creator_id = dataset_creator_id(dataset_dict.get('id'))
+            call_action('dataset_purge', context, dataset_dict)
+            invalidate_package_list(user.id, creator_id)
             return f"The package '{dataset_dict['id']}' is purged."
         except logic.NotAuthorized:
             return "Not authorized to purge this dataset", 401            
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             return f'Error: {str(e)}', 401
 
     return "Method not allowed", 405  # For unsupported methods
 
 
+def request_param(name, default=None):
+    # read a parameter from the query string or, for POST requests, the JSON body
+    value = request.args.get(name)
+    if value is None and request.method == 'POST':
+        value = (request.get_json(silent=True) or {}).get(name)
+    return default if value is None else value
+
+
+def parse_fields(fields):
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return [f.strip() for f in fields or [] if f.strip()]
+
+
 def list_my_packages():
     if request.method == 'POST' or request.method == 'GET':
         try:
@@ -250,78 +749,407 @@ def list_my_packages():
             context = {'user': user.id}
             search_dict = {
                 'q': f'creator_user_id:{user.id}',
-                'rows': 1000  
             }
-            result = logic.get_action('package_search')(context, search_dict)
-            return result
+            rows = min(int(request_param('rows', my_package_list_rows)), my_package_list_max_rows)
+            cursor = request_param('cursor')
+            fields = parse_fields(request_param('fields'))
+            output_format = request_param('format')
+            commit_pending_writes()
+
+            # answer polls with 304 until the user's datasets change; If-None-Match compares weakly,
+            # since proxies that compress the response mark its ETag as weak
+            etag = content_hash([package_list_validator(user.id), rows, cursor, fields, output_format])
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            if output_format == 'ndjson':
+                # send the datasets one JSON document per line, page by page as they are fetched
+                def generate():
+                    for package in iter_search(context, search_dict, rows, cursor, fields):
+                        yield json.dumps(package) + '\n'
+                response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            else:
+                response = jsonify(search_page(context, search_dict, rows, cursor, fields))
+            response.set_etag(etag)
+            return response
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             return f'Error: {str(e)}', 401
 
     return "Method not allowed", 405  # For unsupported methods
 
 
+def review_queue_facets(context, search_dict):
+    key = json.dumps(search_dict, sort_keys=True)
+    facets = review_queue_facet_cache.get(key)
+    if facets is None:
+        facet_dict = dict(search_dict, rows=0, facet='true', **{
+            'facet.field': ['organization', 'creator_user_id'],
+            'facet.limit': -1,
+            'facet.mincount': 1,
+        })
+        facets = call_action('package_search', context, facet_dict)['facets']
+        review_queue_facet_cache.set(key, facets)
+    return facets
+
+
+def review_queue():
+    if request.method == 'GET' or request.method == 'POST':
+        try:
+            if not can_review():
+                return "Not authorized to view the review queue.", 401
+
+            # reviewers need every pending dataset, including private ones of organizations
+            # they do not belong to, so the search runs as the site user
+            site_user = call_action('get_site_user', {'ignore_auth': True}, {})
+            context = {'user': site_user['name']}
+            search_dict = {'q': '*:*', 'include_private': True, 'facet': 'false'}
+            organization = request_param('organization')
+            if organization:
+                search_dict['fq'] = f'organization:{json.dumps(organization)}'
+
+            rows = min(int(request_param('rows', review_queue_rows)), review_queue_max_rows)
+            fields = parse_fields(request_param('fields')) or REVIEW_QUEUE_FIELDS
+            # oldest submissions first
+            page = search_page(context, search_dict, rows, request_param('cursor'), fields, descending=False)
+            page['facets'] = review_queue_facets(context, search_dict)
+            return page
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
+        except Exception as e:
+            traceback.print_exc()
+            return f'Error: {str(e)}', 401
+
+    return "Method not allowed", 405  # For unsupported methods
+
+
+def load_dataset_for_approval(dataset_id):
+    """Return the local dataset and its approval checkpoint.
+
+    A deleted dataset can only be "approved" again when its checkpoint
+    shows that an earlier approval already finished.
+    """
+    # get the dataset with ignore_auth. Note that the reviewer may not has the permission to view this package if it is private
+    context = {'ignore_auth': True}
+    dataset = call_action('package_show', context, {'id': dataset_id})
+    checkpoint = ApprovalCheckpoint.load(dataset['id'])
+    if dataset['state'] == 'deleted' and not checkpoint.reached('local_dataset_deleted'):
+        raise ValueError(f"The dataset '{dataset['name']}' was already deleted. Can not approve it.")
+    return dataset, checkpoint
+
+
+def submit_remote(fn, *args):
+    # run a production call in the shared pool, under the caller's deadline
+    return remote_executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def resolve_remote_owner(dataset, checkpoint):
+    """Make sure the creator and the organization of a dataset exist in production.
+
+    Returns the remote user and the remote organization (None if the dataset
+    has no organization), with the creator added to it as an editor. Steps
+    already recorded in the checkpoint are not repeated, except that the
+    organization and the membership are resolved again when the dataset
+    has moved to another organization since they were recorded.
+
+    The user and the organization are independent, so they are looked up
+    (or created) side by side; only the membership has to wait for both.
+    The checkpoint is only written from the calling thread.
+    """
+    creator = model.User.get(dataset['creator_user_id'])
+    organization = model.Group.get(dataset['owner_org']) if dataset.get('owner_org') else None
+    # plain copies: the ORM objects must not be touched from the pool threads
+    creator = SimpleNamespace(name=creator.name, email=creator.email, fullname=creator.fullname)
+    if organization:
+        organization = SimpleNamespace(name=organization.name, title=organization.title,
+                                       description=organization.description)
+    local_org_id = dataset.get('owner_org') or None
+    moved = checkpoint.data.get('local_org_id') != local_org_id
+    with invalidate_on_failure(creator.name, lambda: organization.name if organization else None):
+        budget = current_deadline()
+        if budget:
+            budget.start_step()
+
+        # create a remote user and a remote organization if they don't exist
+        user_future = org_future = None
+        if not checkpoint.data.get('remote_user_name'):
+            user_future = submit_remote(get_or_create_remote_user, creator.name, creator.email, creator.fullname)
+        if organization and (moved or not checkpoint.data.get('remote_org_id')):
+            org_future = submit_remote(get_remote_organization, organization)
+        concurrent.futures.wait([f for f in (user_future, org_future) if f])
+
+        if user_future:
+            remote_user = user_future.result()
+            checkpoint.advance('remote_user_ensured', remote_user_name=remote_user['name'])
+        else:
+            remote_user = {'name': checkpoint.data['remote_user_name']}
+
+        # add the remote user as an editor of the remote organization
+        remote_organization = None
+        if organization:
+            if org_future:
+                remote_organization = org_future.result()
+                checkpoint.advance('remote_org_ensured', remote_org_id=remote_organization['id'],
+                                   local_org_id=local_org_id)
+            else:
+                remote_organization = {'id': checkpoint.data['remote_org_id'], 'name': organization.name}
+            if budget:
+                budget.start_step()
+            if moved or not checkpoint.reached('membership_ensured'):
+                ensure_remote_editor(remote_user, remote_organization)
+        if moved or not checkpoint.reached('membership_ensured'):
+            checkpoint.advance('membership_ensured', local_org_id=local_org_id,
+                               remote_org_id=remote_organization['id'] if remote_organization else None)
+    return remote_user, remote_organization
+
+
+def prepare_remote_dataset(dataset, remote_organization):
+    """Return a copy of a local dataset dict ready for the production package_create."""
+    dataset = copy.deepcopy(dataset)
+
+    # delete dataset id
+    local_id = dataset.pop('id')
+
+    # delete the creator_user_id
+    del dataset['creator_user_id']
+
+    # change the owner_org id
+    if remote_organization:
+        dataset['owner_org'] = remote_organization['id']
+        del dataset['organization']
+
+    # delete package_id from each resource
+    if 'resources' in dataset.keys():
+        for resource in dataset['resources']:
+            del resource['package_id']
+            del resource['id']
+
+    # mark the production dataset with the Prekan id, so a retry can recognise it
+    extras = [e for e in dataset.get('extras') or [] if e.get('key') != SOURCE_EXTRA]
+    dataset['extras'] = extras + [{'key': SOURCE_EXTRA, 'value': local_id}]
+    return dataset
+
+
+def extra_value(dataset, key):
+    return next((e.get('value') for e in dataset.get('extras') or [] if e.get('key') == key), None)
+
+
+def created_from(remote_dataset, sent_dataset):
+    # whether a production dataset is the one an earlier attempt created from sent_dataset
+    return (extra_value(remote_dataset, SOURCE_EXTRA) == extra_value(sent_dataset, SOURCE_EXTRA)
+            and remote_dataset.get('owner_org') == sent_dataset.get('owner_org'))
+
+
+def push_remote_dataset(remote_user, dataset, organization_name=None, requested_before=False):
+    """Create the dataset in production.
+
+    When an earlier attempt already sent package_create (`requested_before`)
+    but did not record the result, the production dataset with the same name
+    is adopted instead of creating a second copy, provided it carries this
+    dataset's Prekan id and organization. A dataset of the same name that
+    came from elsewhere is never taken over.
+    """
+    with invalidate_on_failure(remote_user['name'], lambda: organization_name):
+        budget = current_deadline()
+        if budget:
+            budget.start_step()
+        if requested_before:
+            remote_dataset = find_remote_dataset(dataset['name'])
+            if remote_dataset and created_from(remote_dataset, dataset):
+                return remote_dataset
+            if remote_dataset:
+                raise ValueError(f"The production dataset '{dataset['name']}' was not created by this approval")
+        return save_remote_dataset(remote_user, dataset)
+
+
+def record_remote_dataset(checkpoint, dataset, remote_dataset, sent_dataset):
+    local_resource_ids = [r['id'] for r in dataset.get('resources') or []]
+    remote_resource_ids = [r['id'] for r in remote_dataset.get('resources') or []]
+    hashes = dataset_hashes(sent_dataset, local_resource_ids, remote_resource_ids)
+    hashes['pending_uploads'] = [r['id'] for r in dataset.get('resources') or [] if r.get('url_type') == 'upload']
+    checkpoint.advance('remote_dataset_created', remote_dataset_id=remote_dataset['id'],
+                       remote_dataset_name=remote_dataset['name'], content_hashes=json.dumps(hashes))
+
+
+def sync_remote_dataset(dataset, checkpoint):
+    """Bring an already approved dataset up to date in production.
+
+    Only the dataset fields and resources whose content hash changed since
+    the last approval are sent, with package_patch and resource-level calls
+    instead of a full re-create.
+    """
+    remote_user, remote_organization = resolve_remote_owner(dataset, checkpoint)
+    sent_dataset = prepare_remote_dataset(dataset, remote_organization)
+    local_resource_ids = [r['id'] for r in dataset.get('resources') or []]
+    hashes = json.loads(checkpoint.data.get('content_hashes') or '{}')
+    hashes.setdefault('resources', {})
+    plan = plan_sync(hashes, sent_dataset, local_resource_ids)
+    remote_id = checkpoint.data['remote_dataset_id']
+
+    budget = current_deadline()
+    if budget:
+        budget.start_step()
+    if plan['fields']:
+        remote_action('package_patch', dict(plan['fields'], id=remote_id))
+    for local_id, remote_resource_id in plan['delete']:
+        remote_action('resource_delete', {'id': remote_resource_id}, idempotent=True)
+        del hashes['resources'][local_id]
+    for local_id, remote_resource_id, resource in plan['update']:
+        remote_action('resource_patch', dict(resource, id=remote_resource_id), idempotent=True)
+        hashes['resources'][local_id] = {'remote_id': remote_resource_id, 'hash': content_hash(resource)}
+    pending_uploads = set(hashes.get('pending_uploads') or [])
+    for local_id, remote_resource_id, resource in plan['update']:
+        if resource.get('url_type') == 'upload':
+            pending_uploads.add(local_id)
+    hashes['pending_uploads'] = sorted(pending_uploads)
+    for local_id, resource in plan['create']:
+        created = remote_action('resource_create', dict(resource, package_id=remote_id))
+        hashes['resources'][local_id] = {'remote_id': created['id'], 'hash': content_hash(resource)}
+        if resource.get('url_type') == 'upload':
+            hashes['pending_uploads'].append(local_id)
+        # resource_create is not idempotent: record it before the next call
+        checkpoint.advance('remote_dataset_created', content_hashes=json.dumps(hashes))
+
+    hashes['fields'] = field_hashes(sent_dataset)
+    checkpoint.advance('remote_dataset_created', remote_dataset_name=sent_dataset['name'],
+                       content_hashes=json.dumps(hashes))
+    return find_remote_dataset(remote_id) or {'id': remote_id, 'name': sent_dataset['name']}
+
+
+def local_upload_path(resource):
+    # path of a file uploaded to Prekan's filestore, or None if it is not stored locally
+    if resource.get('url_type') != 'upload':
+        return None
+    upload = uploader.get_resource_uploader(resource)
+    if not hasattr(upload, 'get_path'):
+        return None
+    path = upload.get_path(resource['id'])
+    return path if os.path.exists(path) else None
+
+
+def transfer_uploaded_files(dataset, checkpoint):
+    """Stream the files uploaded to Prekan into their production resources.
+
+    Only resources listed as pending uploads in the checkpoint are sent, and
+    the list is cleared once every upload has been verified. A pending upload
+    without a local file fails the step.
+    """
+    hashes = json.loads(checkpoint.data.get('content_hashes') or '{}')
+    pending = set(hashes.get('pending_uploads') or [])
+    if not pending:
+        return
+    uploads = []
+    for resource in dataset.get('resources') or []:
+        if resource['id'] not in pending or resource.get('url_type') != 'upload':
+            continue
+        remote_resource = hashes.get('resources', {}).get(resource['id'])
+        path = local_upload_path(resource)
+        if not remote_resource or not path:
+            # production would be left pointing at a Prekan URL that is about to go away
+            raise ValueError(f"The uploaded file of resource {resource['id']} is not in the local filestore")
+        filename = resource['url'].split('/')[-1] or resource['id']
+        uploads.append((resource['id'], remote_resource['remote_id'], path, filename, resource.get('hash')))
+    transfer_files(production, ckan_url, uploads)
+    hashes['pending_uploads'] = []
+    checkpoint.advance('files_transferred', content_hashes=json.dumps(hashes))
+
+
+def delete_approved_dataset(dataset_id, checkpoint):
+    # the checkpoint is committed together with the local package_delete
+    checkpoint.advance('local_dataset_deleted', commit=False)
+    # delete this dataset with ignore_auth context
+    creator_id = dataset_creator_id(dataset_id)
+    call_action('package_delete', {'ignore_auth': True}, {'id': dataset_id})
+    invalidate_package_list(creator_id)
+
+
+def approve_dataset(dataset_id, on_step=None):
+    """Copy a dataset to the production catalog and delete it locally.
+
+    Progress is checkpointed after every step, so approving a dataset again
+    after a failure resumes where the previous attempt stopped. `on_step(name)`
+    is called after each completed step so callers such as the background
+    approval job can report progress.
+    """
+    on_step = on_step or (lambda name: None)
+
+    # actions in the production catalog
+    #    1. find the creator and the owner_org of the dataset
+    #    2. create a user for the creator if doesn't exist 
+    #    3. create a organization for the owner_org if doesn't exists 
+    #    4  add the creator as an editor to the owner_org
+    #    5. create the dataset
+    dataset, checkpoint = load_dataset_for_approval(dataset_id)
+    on_step('dataset_loaded')
+
+    if checkpoint.reached('local_dataset_deleted') and dataset['state'] != 'deleted':
+        # the dataset was approved before and has been resubmitted: send only what changed
+        with deadline(approve_deadline, steps=3 if dataset.get('owner_org') else 2):
+            remote_dataset = sync_remote_dataset(dataset, checkpoint)
+        on_step('remote_owner_resolved')
+        on_step('remote_dataset_created')
+        transfer_uploaded_files(dataset, checkpoint)
+        on_step('files_transferred')
+        delete_approved_dataset(dataset['id'], checkpoint)
+        on_step('local_dataset_deleted')
+        return remote_dataset
+
+    if checkpoint.reached('remote_dataset_created'):
+        remote_dataset = (find_remote_dataset(checkpoint.data['remote_dataset_id'])
+                          or {'id': checkpoint.data['remote_dataset_id'],
+                              'name': checkpoint.data['remote_dataset_name']})
+        on_step('remote_owner_resolved')
+        on_step('remote_dataset_created')
+    else:
+        remote_steps = 3 if dataset.get('owner_org') else 2
+        with deadline(approve_deadline, steps=remote_steps):
+            remote_user, remote_organization = resolve_remote_owner(dataset, checkpoint)
+            on_step('remote_owner_resolved')
+
+            requested_before = checkpoint.reached('remote_dataset_requested')
+            checkpoint.advance('remote_dataset_requested')
+            sent_dataset = prepare_remote_dataset(dataset, remote_organization)
+            try:
+                remote_dataset = push_remote_dataset(remote_user, sent_dataset,
+                                                     (dataset.get('organization') or {}).get('name'),
+                                                     requested_before)
+            except RemoteDatasetRejected:
+                # production created nothing, so a retry must not look for an earlier copy
+                checkpoint.rewind('membership_ensured')
+                raise
+            record_remote_dataset(checkpoint, dataset, remote_dataset, sent_dataset)
+            on_step('remote_dataset_created')
+
+    # copy the uploaded files outside the deadline: large files take as long as they take
+    transfer_uploaded_files(dataset, checkpoint)
+    on_step('files_transferred')
+
+    # action in the local catalog
+    #    1. delete the dataset
+    if not checkpoint.reached('local_dataset_deleted'):
+        delete_approved_dataset(dataset['id'], checkpoint)
+    on_step('local_dataset_deleted')
+    return remote_dataset
+
+
 def approve_package():
     if request.method == 'POST':
         try:
-            user = get_or_create_user()
+            if not can_review():
+                return "Not authorized to approve this dataset.", 401
             dataset_dict = request.get_json()
 
-            if not user.sysadmin and not is_reviewer(user.name):
-                return "Not authorized to approve this dataset.", 401
-    
-            # actions in the production catalog
-            #    1. find the creator and the owner_org of the dataset
-            #    2. create a user for the creator if doesn't exist 
-            #    3. create a organization for the owner_org if doesn't exists 
-            #    4  add the creator as an editor to the owner_org
-            #    5. create the dataset
-
-            # get the dataset with ignore_auth. Note that the reviewer may not has the permission to view this package if it is private
-            context = {'ignore_auth': True}
-            dataset = logic.get_action('package_show')(context, {'id': dataset_dict['id']})
-            if dataset['state'] == 'deleted':
-                return f"The dataset '{dataset['name']}' was already deleted. Can not approve it.", 401
-                
-            creator_user_id = dataset['creator_user_id']
-
-            # create a remote user if doesn't exist
-            creator = model.User.get(creator_user_id)
-            creator_name = creator.name
-            email = creator.email
-            fullname = creator.fullname
-            remote_user = get_or_create_remote_user(creator_name, email, fullname)
-
-            # create a remote organization if doesn't exist and add the remote user as an editor
-            remote_organization = None
-            if 'owner_org' in dataset.keys():
-                organization = model.Group.get(dataset['owner_org'])
-                remote_organization = process_remote_user_and_organization(remote_user, organization)
-
-            # delete dataset id
-            del dataset['id']
-            
-            # delete the creator_user_id
-            del dataset['creator_user_id'] 
-
-            # change the owner_org id
-            if remote_organization:
-                dataset['owner_org'] = remote_organization['id']
-                del dataset['organization']
-
-            # delete package_id from each resource
-            if 'resources' in dataset.keys():
-                for resource in dataset['resources']:
-                    del resource['package_id']
-                    del resource['id']
-                    
-            # save the dataset to the remote CKAN
-            remote_dataset = save_remote_dataset(remote_user, dataset)
-                
-            # action in the local catalog
-            #    1. delete the dataset
-            
-            # delete this dataset with ignore_auth context
-            logic.get_action('package_delete')(context, dataset_dict)
+            if approve_async or dataset_dict.get('async'):
+                # hand the remote work to a background job and return straight away
+                job_id = get_approval_queue().enqueue(dataset_dict['id'])
+                return {'job_id': job_id, 'status': 'queued'}, 202
+
+            remote_dataset = approve_dataset(dataset_dict['id'])
 
             # return f"The package '{dataset['name']}' is moved to the production catalog."
             return remote_dataset
@@ -329,6 +1157,153 @@ def approve_package():
         except logic.NotAuthorized:
             traceback.print_exc()
             return "Not authorized to approve this dataset.", 401            
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
+        except Exception as e:
+            traceback.print_exc()
+            return f'Error: {str(e)}', 401
+
+    return "Method not allowed", 405  # For unsupported methods
+
+
+def approval_status():
+    if request.method == 'GET' or request.method == 'POST':
+        try:
+            if not can_review():
+                return "Not authorized to view approval jobs.", 401
+
+            job_id = request.args.get('job_id') or (request.get_json(silent=True) or {}).get('job_id')
+            if not job_id:
+                return "Missing job_id", 400
+            status = get_approval_queue().status(job_id)
+            if status is None:
+                return f"Approval job '{job_id}' not found", 404
+            return status
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
+        except Exception as e:
+            return f'Error: {str(e)}', 401
+
+    return "Method not allowed", 405  # For unsupported methods
+
+
+def approve_datasets(dataset_ids, workers=None):
+    """Approve several datasets and return one result per dataset id.
+
+    Local reads and writes, including the approval checkpoints, stay on the
+    calling thread. Each distinct creator and organization is resolved in
+    production once, then the datasets are pushed to production by a bounded
+    thread pool of `workers` threads. A failure only affects the dataset (or the
+    creator/organization group) it belongs to.
+    """
+    results = {dataset_id: None for dataset_id in dataset_ids}
+    owners = {}
+    pending = []
+    done = []
+    for dataset_id in results:
+        try:
+            dataset, checkpoint = load_dataset_for_approval(dataset_id)
+            if checkpoint.reached('local_dataset_deleted') and dataset['state'] != 'deleted':
+                # resubmitted after an earlier approval: sync the changes in place
+                with deadline(approve_deadline, steps=3 if dataset.get('owner_org') else 2):
+                    remote_dataset = sync_remote_dataset(dataset, checkpoint)
+                done.append((dataset_id, dataset, checkpoint, remote_dataset, True))
+                continue
+            if checkpoint.reached('remote_dataset_created'):
+                done.append((dataset_id, dataset, checkpoint, {
+                    'id': checkpoint.data['remote_dataset_id'],
+                    'name': checkpoint.data['remote_dataset_name'],
+                }, not checkpoint.reached('local_dataset_deleted')))
+                continue
+
+            owner_key = (dataset['creator_user_id'], dataset.get('owner_org'))
+            if owner_key not in owners:
+                remote_steps = 2 if dataset.get('owner_org') else 1
+                with deadline(approve_deadline, steps=remote_steps):
+                    owners[owner_key] = resolve_remote_owner(dataset, checkpoint)
+            remote_user, remote_organization = owners[owner_key]
+
+            requested_before = checkpoint.reached('remote_dataset_requested')
+            checkpoint.advance('remote_dataset_requested', commit=False, remote_user_name=remote_user['name'],
+                               remote_org_id=remote_organization['id'] if remote_organization else None,
+                               local_org_id=dataset.get('owner_org') or None)
+            organization_name = (dataset.get('organization') or {}).get('name')
+            pending.append((dataset_id, dataset, checkpoint, remote_user,
+                            prepare_remote_dataset(dataset, remote_organization), organization_name,
+                            requested_before))
+        except Exception as e:
+            results[dataset_id] = {'success': False, 'error': str(e)}
+
+    # record every 'remote_dataset_requested' checkpoint before anything is sent
+    model.Session.commit()
+
+    def push(remote_user, remote_dataset, organization_name, requested_before):
+        with deadline(approve_deadline):
+            return push_remote_dataset(remote_user, remote_dataset, organization_name, requested_before)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or approve_batch_workers) as executor:
+        futures = {
+            executor.submit(push, remote_user, sent_dataset, organization_name, requested_before):
+                (dataset_id, dataset, checkpoint, sent_dataset)
+            for dataset_id, dataset, checkpoint, remote_user, sent_dataset, organization_name, requested_before
+            in pending
+        }
+        for future in concurrent.futures.as_completed(futures):
+            dataset_id, dataset, checkpoint, sent_dataset = futures[future]
+            try:
+                remote_dataset = future.result()
+            except Exception as e:
+                if isinstance(e, RemoteDatasetRejected):
+                    checkpoint.rewind('membership_ensured')
+                results[dataset_id] = {'success': False, 'error': str(e)}
+                continue
+            record_remote_dataset(checkpoint, dataset, remote_dataset, sent_dataset)
+            done.append((dataset_id, dataset, checkpoint, remote_dataset, True))
+
+    # delete the approved datasets in the local catalog
+    for dataset_id, dataset, checkpoint, remote_dataset, delete_local in done:
+        if not delete_local:
+            results[dataset_id] = {'success': True, 'result': remote_dataset}
+            continue
+        try:
+            transfer_uploaded_files(dataset, checkpoint)
+        except Exception as e:
+            traceback.print_exc()
+            results[dataset_id] = {'success': False, 'error': str(e)}
+            continue
+        results[dataset_id] = {'success': True, 'result': remote_dataset}
+        try:
+            delete_approved_dataset(dataset['id'], checkpoint)
+        except Exception as e:
+            traceback.print_exc()
+            model.Session.rollback()
+            results[dataset_id]['local_delete_error'] = str(e)
+
+    return [dict(id=dataset_id, **result) for dataset_id, result in results.items()]
+
+
+def approve_package_batch():
+    if request.method == 'POST':
+        try:
+            if not can_review():
+                return "Not authorized to approve these datasets.", 401
+            data_dict = request.get_json()
+
+            dataset_ids = data_dict.get('ids') if isinstance(data_dict, dict) else data_dict
+            if not isinstance(dataset_ids, list) or not dataset_ids:
+                return "Expected a list of dataset ids in 'ids'.", 400
+            if len(dataset_ids) > approve_batch_max_size:
+                return f"At most {approve_batch_max_size} datasets can be approved in one batch.", 400
+
+            return {'results': approve_datasets(dataset_ids)}
+        except logic.NotAuthorized:
+            traceback.print_exc()
+            return "Not authorized to approve these datasets.", 401
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             traceback.print_exc()
             return f'Error: {str(e)}', 401
@@ -339,23 +1314,144 @@ def approve_package():
 def reject_package():
     if request.method == 'POST':
         try:
-            user = get_or_create_user()
+            if not can_review():
+                return "Not authorized to approve this dataset.", 401
             dataset_dict = request.get_json()
 
-            if not user.sysadmin and not is_reviewer(user.name):
-                return "Not authorized to approve this dataset.", 401
-            
             # Note that the reviewer may not has the permission to view this package if it is private
             context = {'ignore_auth': True}
-            logic.get_action('dataset_purge')(context, {'id': dataset_dict['id']})
+            creator_id = dataset_creator_id(dataset_dict['id'])
+            call_action('dataset_purge', context, {'id': dataset_dict['id']})
+            invalidate_package_list(creator_id)
 
             return f"The dataset '{dataset_dict['id']}' is rejected and purged."
         except logic.NotAuthorized:
             traceback.print_exc()
             return "Not authorized to approve this dataset.", 401            
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
+        except Exception as e:
+            traceback.print_exc()
+            return f'Error: {str(e)}', 401
+
+    return "Method not allowed", 405  # For unsupported methods
+
+
+def remove_from_search_index(dataset_ids):
+    # one delete-by-query (and one Solr commit) per chunk of ids instead of one per dataset
+    conn = search.make_connection()
+    site_id = toolkit.config.get('ckan.site_id')
+    for i in range(0, len(dataset_ids), search_delete_chunk_size):
+        ids = ' OR '.join(json.dumps(dataset_id) for dataset_id in dataset_ids[i:i + search_delete_chunk_size])
+        conn.delete(q=f'+site_id:{json.dumps(site_id)} +id:({ids})', commit=True)
+
+
+def purge_dataset_rows(package):
+    # the body of CKAN's dataset_purge without its commit, so it can run in a savepoint
+    relationships = model.Session.query(model.PackageRelationship).filter(or_(
+        model.PackageRelationship.subject_package_id == package.id,
+        model.PackageRelationship.object_package_id == package.id
+    ))
+    for relationship in relationships.all():
+        relationship.purge()
+    members = model.Session.query(model.Member).filter(
+        model.Member.table_id == package.id,
+        model.Member.table_name == 'package'
+    )
+    for member in members.all():
+        member.purge()
+    package.purge()
+
+
+def purge_datasets(dataset_ids):
+    """Purge several datasets and return a status for each id.
+
+    Datasets are purged in chunks, one database transaction per chunk and a
+    savepoint per dataset, without CKAN's per-dataset index update. They
+    are then removed from the search index with batched delete queries.
+    """
+    statuses = {}
+    purged = []
+    creator_ids = set()
+    with index_notifications_suppressed():
+        for i in range(0, len(dataset_ids), purge_chunk_size):
+            chunk_purged = []
+            for dataset_id in dataset_ids[i:i + purge_chunk_size]:
+                package = model.Package.get(dataset_id)
+                if package is None:
+                    statuses[dataset_id] = {'success': False, 'error': 'Dataset was not found'}
+                    continue
+                try:
+                    with model.Session.begin_nested():
+                        creator_ids.add(package.creator_user_id)
+                        package_id = package.id
+                        purge_dataset_rows(package)
+                    chunk_purged.append(package_id)
+                    statuses[dataset_id] = {'success': True}
+                except Exception as e:
+                    traceback.print_exc()
+                    statuses[dataset_id] = {'success': False, 'error': str(e)}
+            model.Session.commit()
+            purged.extend(chunk_purged)
+
+    if purged:
+        remove_from_search_index(purged)
+    invalidate_package_list(*creator_ids)
+    return [dict(id=dataset_id, **status) for dataset_id, status in statuses.items()]
+
+
+def reject_package_batch():
+    if request.method == 'POST':
+        try:
+            if not can_review():
+                return "Not authorized to reject these datasets.", 401
+            data_dict = request.get_json()
+
+            dataset_ids = data_dict.get('ids') if isinstance(data_dict, dict) else data_dict
+            if not isinstance(dataset_ids, list) or not dataset_ids:
+                return "Expected a list of dataset ids in 'ids'.", 400
+            if len(dataset_ids) > reject_batch_max_size:
+                return f"At most {reject_batch_max_size} datasets can be rejected in one batch.", 400
+
+            return {'results': purge_datasets(list(dict.fromkeys(dataset_ids)))}
+        except UpstreamUnavailable as e:
+            traceback.print_exc()
+            return f'Service unavailable: {str(e)}', 503
         except Exception as e:
             traceback.print_exc()
             return f'Error: {str(e)}', 401
 
     return "Method not allowed", 405  # For unsupported methods
 
+
+def upstream_status():
+    try:
+        if not can_review():
+            return "Not authorized to view the upstream status.", 401
+        return jsonify(breaker_metrics())
+    except UpstreamUnavailable as e:
+        traceback.print_exc()
+        return f'Service unavailable: {str(e)}', 503
+    except Exception as e:
+        traceback.print_exc()
+        return f'Error: {str(e)}', 401
+
+
+def start_request_timer():
+    g.ndp_request_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.pop('ndp_request_started', None)
+    if started is not None:
+        endpoint = (request.endpoint or '').rsplit('.', 1)[-1]
+        request_seconds.observe(time.perf_counter() - started, endpoint)
+        requests_total.inc(endpoint, str(response.status_code))
+        if response.status_code >= 400:
+            request_errors_total.inc(endpoint)
+    return response
+
+
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
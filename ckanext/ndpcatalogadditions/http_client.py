@@ -0,0 +1,127 @@
+import os
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ckanext.ndp.upstream import current_deadline, DeadlineExceeded
+from ckanext.ndp.metrics import remote_call_seconds, remote_call_errors_total
+
+
+pool_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__HTTP_POOL_SIZE', '10'))
+connect_timeout = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__HTTP_CONNECT_TIMEOUT', '3.05'))
+read_timeout = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__HTTP_READ_TIMEOUT', '30'))
+max_retries = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__HTTP_MAX_RETRIES', '2'))
+backoff_factor = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__HTTP_BACKOFF_FACTOR', '0.3'))
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class HttpClient:
+    """Pooled keep-alive HTTP client for calls to an upstream service.
+
+    All calls share one `requests.Session`, so connections to the upstream
+    are reused instead of paying a TCP/TLS handshake per call. Every call
+    gets a connect/read timeout. Idempotent calls (GET, or POSTs to
+    read-only CKAN actions marked with `idempotent=True`) are retried with
+    exponential backoff on connection errors and 502/503/504 responses.
+
+    With a `breaker`, calls fail fast while the upstream's circuit is open.
+    Inside a `upstream.deadline(...)` block, timeouts and retries are
+    clamped to the time left in the current step.
+
+    Every call is timed under `name` and the last segment of the URL path
+    (the CKAN action), retries included.
+    """
+
+    def __init__(self, headers=None, breaker=None, name='upstream', pool_size=pool_size, connect_timeout=connect_timeout,
+                 read_timeout=read_timeout, max_retries=max_retries, backoff_factor=backoff_factor):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def _timeout(self, deadline):
+        if deadline is None:
+            return self.timeout
+        budget = deadline.timeout()
+        return (min(self.timeout[0], budget), min(self.timeout[1], budget))
+
+    def _send(self, method, url, deadline, **kwargs):
+        # may raise DeadlineExceeded: do it before taking a (half-open trial) slot in the breaker
+        kwargs['timeout'] = kwargs.get('timeout') or self._timeout(deadline)
+        if self.breaker is not None:
+            self.breaker.before_call()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            if deadline is not None and deadline.remaining() <= 0:
+                raise DeadlineExceeded(f"Request deadline exceeded calling {url}") from e
+            raise
+        except requests.RequestException:
+            # e.g. a broken chunked response: the upstream misbehaved
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        except BaseException:
+            # anything else (a bad URL, an interrupt) must not keep the trial slot forever
+            if self.breaker is not None:
+                self.breaker.release()
+            raise
+        if self.breaker is not None:
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        return response
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        action = urlsplit(url).path.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self._request(method, url, idempotent, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            remote_call_seconds.observe(time.perf_counter() - start, self.name, action)
+            if failed:
+                remote_call_errors_total.inc(self.name, action)
+
+    def _request(self, method, url, idempotent, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        deadline = current_deadline()
+        attempts = self.max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            delay = self.backoff_factor * (2 ** attempt)
+            # give up early when the backoff would not leave time for another attempt
+            retry = attempt < attempts - 1 and (deadline is None or deadline.remaining() > delay)
+            try:
+                response = self._send(method, url, deadline, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not retry:
+                    raise
+            else:
+                if not retry or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, idempotent=False, **kwargs):
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,151 @@
+import concurrent.futures
+import copy
+import importlib
+import os
+import threading
+import uuid
+
+import ckan.model as model
+from ckan.plugins import toolkit
+
+
+# 'ckan' runs approvals on CKAN's background job workers (`ckan jobs worker`),
+# 'inprocess' on a thread pool inside the web process (for tests and development).
+# A 'package.module:Class' path selects a custom queue.
+approval_queue_backend = os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVAL_QUEUE', 'ckan')
+approval_queue_name = os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVAL_QUEUE_NAME', 'default')
+approval_job_timeout = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVAL_JOB_TIMEOUT', '600'))
+inprocess_workers = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__APPROVAL_INPROCESS_WORKERS', '2'))
+
+APPROVAL_STEPS = ('dataset_loaded', 'remote_owner_resolved', 'remote_dataset_created', 'files_transferred',
+                  'local_dataset_deleted')
+
+
+def new_status(dataset_id):
+    return {
+        'dataset_id': dataset_id,
+        'status': 'queued',
+        'steps': {step: 'pending' for step in APPROVAL_STEPS},
+        'result': None,
+        'error': None,
+    }
+
+
+def execute_approval(dataset_id, status, save):
+    """Run one approval, recording progress in `status` and persisting it with `save`."""
+    from ckanext.ndp.controller import approve_dataset
+
+    def on_step(name):
+        status['steps'][name] = 'done'
+        save()
+
+    status['status'] = 'started'
+    save()
+    try:
+        remote_dataset = approve_dataset(dataset_id, on_step=on_step)
+    except Exception as e:
+        status['status'] = 'failed'
+        status['error'] = str(e)
+        save()
+        raise
+    status['status'] = 'finished'
+    status['result'] = {'id': remote_dataset.get('id'), 'name': remote_dataset.get('name')}
+    save()
+    return status['result']
+
+
+def approve_job(dataset_id):
+    # entry point run by `ckan jobs worker`; progress is kept in the RQ job meta
+    from rq import get_current_job
+
+    job = get_current_job()
+    status = job.meta.setdefault('approval', new_status(dataset_id))
+    return execute_approval(dataset_id, status, job.save_meta)
+
+
+class CkanJobQueue:
+    """Approval queue backed by CKAN's background jobs (RQ on Redis)."""
+
+    def enqueue(self, dataset_id):
+        job = toolkit.enqueue_job(approve_job, [dataset_id], title=f'Approve dataset {dataset_id}',
+                                  queue=approval_queue_name, rq_kwargs={'timeout': approval_job_timeout})
+        job.meta['approval'] = new_status(dataset_id)
+        job.save_meta()
+        return job.id
+
+    def status(self, job_id):
+        from ckan.lib.jobs import job_from_id
+
+        try:
+            job = job_from_id(job_id)
+        except KeyError:
+            return None
+        status = dict(job.meta.get('approval') or new_status(None))
+        if job.is_failed and status['status'] != 'failed':
+            # the job died without reaching our own error handling (e.g. a timeout)
+            status['status'] = 'failed'
+            status['error'] = (job.exc_info or '').strip().split('\n')[-1]
+        status['job_id'] = job_id
+        return status
+
+
+class InProcessJobQueue:
+    """Runs approvals on a thread pool in the current process and keeps status in memory."""
+
+    def __init__(self, workers=inprocess_workers):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def _run(self, dataset_id, status):
+        try:
+            execute_approval(dataset_id, status, lambda: None)
+        except Exception:
+            pass
+        finally:
+            model.Session.remove()
+
+    def enqueue(self, dataset_id):
+        job_id = str(uuid.uuid4())
+        status = new_status(dataset_id)
+        with self._lock:
+            self.jobs[job_id] = status
+        self.executor.submit(self._run, dataset_id, status)
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            status = self.jobs.get(job_id)
+            if status is None:
+                return None
+            status = copy.deepcopy(status)
+        status['job_id'] = job_id
+        return status
+
+
+APPROVAL_QUEUES = {
+    'ckan': CkanJobQueue,
+    'inprocess': InProcessJobQueue,
+}
+
+_approval_queue = None
+_approval_queue_lock = threading.Lock()
+
+
+def get_approval_queue():
+    global _approval_queue
+    if _approval_queue is None:
+        with _approval_queue_lock:
+            if _approval_queue is None:
+                if approval_queue_backend in APPROVAL_QUEUES:
+                    queue_class = APPROVAL_QUEUES[approval_queue_backend]
+                else:
+                    module_name, class_name = approval_queue_backend.split(':')
+                    queue_class = getattr(importlib.import_module(module_name), class_name)
+                _approval_queue = queue_class()
+    return _approval_queue
+
+
+def set_approval_queue(queue):
+    global _approval_queue
+    _approval_queue = queue
@@ -1,22 +1,242 @@
-
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 
 import requests
 from jose import jwt
 from jose.exceptions import JWTError
 from ckan.plugins import toolkit
+from ckanext.ndp.upstream import get_breaker, UpstreamUnavailable
+from ckanext.ndp.metrics import registry, phase
+from ckanext.ndp.cache import shared_cache
 
 
-def verify_and_decode_token(token, server_url, realm, client_id):
-    # Fetch the public key from Keycloak
+# seconds before the cached keys are considered stale and refreshed in the background
+jwks_ttl = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__JWKS_TTL', '300'))
+
+# seconds after the last successful fetch before the cached keys are no longer trusted
+jwks_hard_expiry = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__JWKS_HARD_EXPIRY', '86400'))
+
+# minimum seconds between two fetches triggered by an unknown kid
+jwks_min_refetch_interval = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__JWKS_MIN_REFETCH_INTERVAL', '10'))
+
+jwks_fetch_timeout = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__JWKS_FETCH_TIMEOUT', '5'))
+
+# maximum number of verified tokens kept in memory
+token_cache_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__TOKEN_CACHE_SIZE', '1024'))
+
+
+class JwksStore:
+    """Process-wide store of the Keycloak signing keys indexed by kid.
+
+    Keys are fetched once and kept for `ttl` seconds. A background thread
+    refreshes them before they go stale, so in steady state a token check
+    never leaves the process. An unknown kid triggers a single fetch (other
+    threads wait for it instead of issuing their own). If Keycloak can not
+    be reached the last good key set keeps serving until `hard_expiry`.
+
+    With a `shared` cache, keys fetched by one worker are published there
+    and a worker missing keys adopts them before asking Keycloak itself.
+    """
+
+    def __init__(self, key_url, ttl=jwks_ttl, hard_expiry=jwks_hard_expiry,
+                 min_refetch_interval=jwks_min_refetch_interval, timeout=jwks_fetch_timeout, shared=None):
+        self.key_url = key_url
+        self.shared = shared
+        self.ttl = ttl
+        self.hard_expiry = hard_expiry
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.keys = {}
+        self.fetched_at = 0
+        self.last_attempt = 0
+        self.fetch_count = 0
+        self._fetch_lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def _fetch(self):
+        if self.shared is not None:
+            keys = self.shared.get(self.key_url)
+            # adopt keys another worker fetched when they differ from ours (we are cold or miss a kid)
+            if keys and set(keys) != set(self.keys):
+                self.keys = keys
+                self.fetched_at = time.monotonic()
+                return keys
+
+        breaker = get_breaker('keycloak')
+        breaker.before_call()
+        try:
+            with phase('jwks_fetch'):
+                response = requests.get(self.key_url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        keys = {k['kid']: k for k in response.json()['keys']}
+        self.keys = keys
+        if self.shared is not None:
+            self.shared.set(self.key_url, keys)
+        self.fetched_at = time.monotonic()
+        self.fetch_count += 1
+        return keys
+
+    def refresh(self, force=False):
+        """Fetch the keys unless another thread has just done it.
+
+        Returns the current key set. A failed fetch keeps the previous keys.
+        """
+        attempt_started = time.monotonic()
+        with self._fetch_lock:
+            # another thread refreshed the keys while we were waiting for the lock
+            if self.fetched_at >= attempt_started:
+                return self.keys
+            if not force and attempt_started - self.last_attempt < self.min_refetch_interval:
+                return self.keys
+            self.last_attempt = time.monotonic()
+            try:
+                return self._fetch()
+            except (requests.RequestException, UpstreamUnavailable, ValueError, KeyError) as e:
+                print(f"Failed to fetch Keycloak keys: {str(e)}")
+                return self.keys
+
+    def is_expired(self):
+        return time.monotonic() - self.fetched_at > self.hard_expiry
+
+    def get_key(self, kid):
+        self.start_refresher()
+        keys = self.keys
+        if not keys or self.is_expired():
+            keys = self.refresh(force=True)
+        elif kid not in keys:
+            keys = self.refresh()
+        if not keys or self.is_expired():
+            raise UpstreamUnavailable("Keycloak is unavailable and no signing keys are cached")
+        return keys.get(kid)
+
+    def _run_refresher(self):
+        while not self._stop.wait(max(self.ttl * 0.8, 1)):
+            self.refresh(force=True)
+
+    def start_refresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._fetch_lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._run_refresher,
+                                               name='ndp-jwks-refresher', daemon=True)
+            self._refresher.start()
+
+    def stop_refresher(self):
+        self._stop.set()
+
+
+_jwks_stores = {}
+_jwks_stores_lock = threading.Lock()
+
+
+def get_jwks_store(server_url, realm):
     key_url = f"{server_url}/realms/{realm}/protocol/openid-connect/certs"
-    response = requests.get(key_url)
-    keys = response.json()['keys']
+    store = _jwks_stores.get(key_url)
+    if store is None:
+        with _jwks_stores_lock:
+            store = _jwks_stores.setdefault(key_url, JwksStore(key_url, shared=shared_cache('jwks', ttl=jwks_ttl)))
+    return store
+
+
+class TokenCache:
+    """Bounded LRU cache of verified tokens.
+
+    Entries are keyed by a SHA-256 digest of the token, so raw tokens are
+    never kept in memory, and hold the extracted user info until the
+    token's `exp` claim. With a `shared` cache, tokens verified by another
+    worker are found there on a local miss.
+    """
+
+    def __init__(self, maxsize=token_cache_size, shared=None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, user_info = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user_info
+                del self._entries[key]
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                expires_at, user_info = entry
+                self._store(key, user_info, expires_at)
+                self.hits += 1
+                return user_info
+        self.misses += 1
+        return None
+
+    def set(self, token, user_info, expires_at):
+        if self.maxsize <= 0 or not expires_at or expires_at <= time.time():
+            return
+        key = self.key(token)
+        self._store(key, user_info, expires_at)
+        if self.shared is not None:
+            self.shared.set(key, [expires_at, user_info], ttl=expires_at - time.time())
+
+    def _store(self, key, user_info, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, user_info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+
+token_cache = TokenCache(shared=shared_cache('tokens'))
+
+registry.counter_function(
+    'ndp_token_cache_lookups_total', 'Verified token cache lookups by result, shared cache hits included.',
+    lambda: {('hit',): token_cache.hits, ('miss',): token_cache.misses}, ('result',))
+registry.gauge(
+    'ndp_token_cache_entries', 'Verified tokens held in the worker\'s token cache.',
+    lambda: {(): token_cache.stats()['size']})
+
+
+def verify_and_decode_token(token, server_url, realm, client_id):
     try:
-        # Verify and decode the token
+        # Verify and decode the token with the cached public key
         header = jwt.get_unverified_header(token)
-        key = [k for k in keys if k['kid'] == header['kid']][0]
+        key = get_jwks_store(server_url, realm).get_key(header.get('kid'))
+        if key is None:
+            print(f"Token verification failed: unknown key id {header.get('kid')}")
+            return None
         decoded_token = jwt.decode(
             token,
             key,
@@ -44,17 +264,19 @@ def extract_user_info(decoded_token):
 
 
 def get_user_info(token: str):
+    user_info = token_cache.get(token)
+    if user_info is not None:
+        return dict(user_info)
 
     server_url = os.getenv('CKANEXT__KEYCLOAK__SERVER_URL')
     realm = os.getenv('CKANEXT__KEYCLOAK__REALM_NAME')
     client_id = "account"
     
-    decoded_token = verify_and_decode_token(token, server_url, realm, client_id)
+    with phase('token_verification'):
+        decoded_token = verify_and_decode_token(token, server_url, realm, client_id)
     if decoded_token:
         user_info = extract_user_info(decoded_token)
-        return user_info
+        token_cache.set(token, user_info, decoded_token.get('exp'))
+        return dict(user_info)
     else:
         raise toolkit.NotAuthorized('Invalid Keycloak token')
-
-
-
@@ -0,0 +1,186 @@
+import bisect
+import contextlib
+import threading
+import time
+
+
+# upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            yield self.name + _labels(self.labelnames, labels), value
+
+
+class Gauge:
+    """Current values read when the metrics are rendered.
+
+    `collect` returns {label values: value}; it is called on every render, so
+    the gauge shows state held elsewhere without being updated in step with it.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield self.name + _labels(self.labelnames, labels), value
+
+
+class CounterFunction(Gauge):
+    """Counter kept elsewhere (e.g. by a cache), read when the metrics are rendered."""
+
+    type = 'counter'
+
+
+class Histogram:
+    """Latency histogram with a fixed set of label names.
+
+    `observe` only bisects into the bucket bounds and bumps one bucket under
+    a lock; the cumulative counts Prometheus expects are built at render time.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # one count per bucket plus +Inf, then the sum of observations
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return sum(entry[:-1]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(entry)) for labels, entry in self._values.items()]
+        for labels, entry in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(self.labelnames, labels, [('le', _number(bound))]), cumulative
+            yield self.name + '_sum' + _labels(self.labelnames, labels), entry[-1]
+            yield self.name + '_count' + _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, collect, labelnames=()):
+        return self.register(Gauge(name, documentation, collect, labelnames))
+
+    def counter_function(self, name, documentation, collect, labelnames=()):
+        return self.register(CounterFunction(name, documentation, collect, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{sample} {_number(value)}' for sample, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.histogram(
+    'ndp_request_duration_seconds', 'Latency of the /ndp endpoints.', ('endpoint',))
+requests_total = registry.counter(
+    'ndp_requests_total', 'Requests to the /ndp endpoints by response status.', ('endpoint', 'status'))
+request_errors_total = registry.counter(
+    'ndp_request_errors_total', 'Requests to the /ndp endpoints answered with an error status.', ('endpoint',))
+phase_seconds = registry.histogram(
+    'ndp_phase_duration_seconds',
+    'Time spent in token verification, JWKS fetches and user/organization resolution.', ('phase',))
+ckan_action_seconds = registry.histogram(
+    'ndp_ckan_action_duration_seconds', 'Time spent in local CKAN action calls.', ('action',))
+remote_call_seconds = registry.histogram(
+    'ndp_remote_call_duration_seconds', 'Time spent in calls to upstream services, retries included.',
+    ('service', 'action'))
+remote_call_errors_total = registry.counter(
+    'ndp_remote_call_errors_total', 'Upstream calls that raised or returned an error status.',
+    ('service', 'action'))
+
+
+@contextlib.contextmanager
+def timed(histogram, *labels):
+    """Observe the time spent in the block, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+
+def phase(name):
+    return timed(phase_seconds, name)
@@ -0,0 +1,42 @@
+"""create ndp_approval_state
+
+Revision ID: 3f1c2a9d7b04
+Revises:
+Create Date: 2026-10-17 09:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b04'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'ndp_approval_state' in inspector.get_table_names():
+        # created on first use by earlier versions of the extension
+        columns = {c['name'] for c in inspector.get_columns('ndp_approval_state')}
+        if 'local_org_id' not in columns:
+            op.add_column('ndp_approval_state', sa.Column('local_org_id', sa.UnicodeText))
+        return
+    op.create_table(
+        'ndp_approval_state',
+        sa.Column('dataset_id', sa.UnicodeText, primary_key=True),
+        sa.Column('state', sa.UnicodeText, nullable=False),
+        sa.Column('remote_user_name', sa.UnicodeText),
+        sa.Column('remote_org_id', sa.UnicodeText),
+        sa.Column('local_org_id', sa.UnicodeText),
+        sa.Column('remote_dataset_id', sa.UnicodeText),
+        sa.Column('remote_dataset_name', sa.UnicodeText),
+        sa.Column('content_hashes', sa.UnicodeText),
+        sa.Column('updated', sa.DateTime),
+    )
+
+
+def downgrade():
+    op.drop_table('ndp_approval_state')
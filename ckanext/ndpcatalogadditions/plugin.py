@@ -1,12 +1,15 @@
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
 from flask import Blueprint
-from ckanext.ndp.controller import create_package, update_package, delete_package, purge_package, list_my_packages, approve_package, reject_package
+from ckanext.ndp.cli import get_commands
+from ckanext.ndp.cache import start_invalidation_listener
+from ckanext.ndp.controller import create_package, create_package_batch, update_package, delete_package, purge_package, list_my_packages, review_queue, approve_package, approve_package_batch, approval_status, reject_package, reject_package_batch, upstream_status, metrics, start_request_timer, record_request
 
 
 class NdpcatalogadditionsPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IConfigurer)
     plugins.implements(plugins.IBlueprint)    
+    plugins.implements(plugins.IClick)
     
     # IConfigurer
     def update_config(self, config_):
@@ -14,8 +17,15 @@ class NdpcatalogadditionsPlugin(plugins.SingletonPlugin):
         toolkit.add_public_directory(config_, "public")
         toolkit.add_resource("assets", "ndp")
 
+    # IClick
+    def get_commands(self):
+        return get_commands()
+
     def get_blueprint(self):
         blueprint = Blueprint(self.name, self.__module__)
+        blueprint.before_request(start_request_timer)
+        blueprint.before_request(start_invalidation_listener)
+        blueprint.after_request(record_request)
 
         blueprint.add_url_rule(
             u'/ndp/package_create',
@@ -24,6 +34,13 @@ class NdpcatalogadditionsPlugin(plugins.SingletonPlugin):
             methods=['POST']
         )
 
+        blueprint.add_url_rule(
+            u'/ndp/package_create_batch',
+            u'create_package_batch',
+            create_package_batch,
+            methods=['POST']
+        )
+
         blueprint.add_url_rule(
             u'/ndp/package_update',
             u'update_package',
@@ -52,6 +69,13 @@ class NdpcatalogadditionsPlugin(plugins.SingletonPlugin):
             methods=['GET', 'POST']
         )
 
+        blueprint.add_url_rule(
+            u'/ndp/review_queue',
+            u'review_queue',
+            review_queue,
+            methods=['GET', 'POST']
+        )
+
         blueprint.add_url_rule(
             u'/ndp/package_approve',
             u'approve_package',
@@ -59,6 +83,20 @@ class NdpcatalogadditionsPlugin(plugins.SingletonPlugin):
             methods=['POST']
         )
 
+        blueprint.add_url_rule(
+            u'/ndp/package_approve_batch',
+            u'approve_package_batch',
+            approve_package_batch,
+            methods=['POST']
+        )
+
+        blueprint.add_url_rule(
+            u'/ndp/approval_status',
+            u'approval_status',
+            approval_status,
+            methods=['GET', 'POST']
+        )
+
         blueprint.add_url_rule(
             u'/ndp/package_reject',
             u'reject_package',
@@ -66,5 +104,26 @@ class NdpcatalogadditionsPlugin(plugins.SingletonPlugin):
             methods=['POST']
         )
 
+        blueprint.add_url_rule(
+            u'/ndp/package_reject_batch',
+            u'reject_package_batch',
+            reject_package_batch,
+            methods=['POST']
+        )
+
+        blueprint.add_url_rule(
+            u'/ndp/upstream_status',
+            u'upstream_status',
+            upstream_status,
+            methods=['GET']
+        )
+
+        blueprint.add_url_rule(
+            u'/ndp/metrics',
+            u'metrics',
+            metrics,
+            methods=['GET']
+        )
+
         return blueprint
         
@@ -0,0 +1,117 @@
+import json
+import re
+
+from ckanext.ndp.sync import content_hash
+
+
+# search index fields compared between Prekan and production; the ids approve_package
+# replaces (dataset, resources, creator, owner_org) are left out, the organization is
+# compared by name
+RECONCILE_FIELDS = (
+    'name', 'title', 'notes', 'url', 'version', 'author', 'author_email', 'maintainer',
+    'maintainer_email', 'license_id', 'organization', 'capacity', 'tags',
+    'res_name', 'res_description', 'res_format', 'res_url',
+)
+
+# multi-valued fields whose order carries no meaning
+UNORDERED_FIELDS = {'tags'}
+
+# URL of a file uploaded to a CKAN filestore; it embeds the dataset and resource ids, which
+# differ between the catalogs, so only the file name is compared
+UPLOAD_URL = re.compile(r'/dataset/[^/]+/resource/[^/]+/download/([^/?#]*)')
+
+
+def resource_url(url):
+    match = UPLOAD_URL.search(url) if isinstance(url, str) else None
+    return match.group(1) if match else url
+
+
+def normalize(document):
+    """Return the comparable part of a search index document.
+
+    Empty values are dropped, since one catalog may omit a field the other
+    stores empty, unordered lists are sorted, and the URLs of uploaded files
+    are reduced to the file name.
+    """
+    normalized = {}
+    for field in RECONCILE_FIELDS:
+        value = document.get(field)
+        if value is None or value == '' or value == []:
+            continue
+        if field == 'res_url':
+            value = [resource_url(url) for url in value] if isinstance(value, list) else resource_url(value)
+        if field in UNORDERED_FIELDS and isinstance(value, list):
+            value = sorted(value)
+        normalized[field] = value
+    return normalized
+
+
+def metadata_hash(document):
+    return content_hash(normalize(document))
+
+
+def index_document(package):
+    """Return the `RECONCILE_FIELDS` of a package dict as CKAN's search index stores them."""
+    resources = package.get('resources') or []
+    document = {field: package.get(field) for field in RECONCILE_FIELDS}
+    document['id'] = package['id']
+    document['organization'] = (package.get('organization') or {}).get('name')
+    document['capacity'] = 'private' if package.get('private') else 'public'
+    document['tags'] = [tag['name'] for tag in package.get('tags') or []]
+    for key in ('name', 'description', 'format', 'url'):
+        document['res_' + key] = [resource.get(key) or '' for resource in resources]
+    return document
+
+
+def iter_remote(client, ckan_url, fq=None, rows=1000):
+    """Yield the production datasets ordered by name, one keyset page at a time.
+
+    Only `RECONCILE_FIELDS` and the id are requested from production's
+    package_search, so memory stays at one page whatever the catalog size.
+    """
+    last_name = None
+    while True:
+        filters = [f'({fq})'] if fq else []
+        if last_name is not None:
+            filters.append(f'name:{{{json.dumps(last_name)} TO *]')
+        data = {
+            'q': '*:*',
+            'fq': ' AND '.join(filters),
+            'sort': 'name asc',
+            'rows': rows,
+            'fl': ['id'] + list(RECONCILE_FIELDS),
+            'include_private': True,
+        }
+        response = client.post(f'{ckan_url}/api/3/action/package_search', idempotent=True, json=data)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to search the production catalog: {response.text}")
+        results = response.json()['result']['results']
+        for document in results:
+            yield document
+        if len(results) < rows:
+            return
+        last_name = results[-1]['name']
+
+
+def reconcile(local, remote):
+    """Compare two streams of search documents, both ordered by name.
+
+    Yields (status, local_document, remote_document) for every dataset,
+    with status 'missing' (only in Prekan), 'extra' (only in production),
+    'changed' (different metadata hash) or 'same'. The streams are merged
+    in step, so only the current document of each is held in memory.
+    """
+    local, remote = iter(local), iter(remote)
+    local_document, remote_document = next(local, None), next(remote, None)
+    while local_document is not None or remote_document is not None:
+        if remote_document is None or (local_document is not None
+                                       and local_document['name'] < remote_document['name']):
+            yield 'missing', local_document, None
+            local_document = next(local, None)
+        elif local_document is None or remote_document['name'] < local_document['name']:
+            yield 'extra', None, remote_document
+            remote_document = next(remote, None)
+        else:
+            same = metadata_hash(local_document) == metadata_hash(remote_document)
+            yield ('same' if same else 'changed'), local_document, remote_document
+            local_document, remote_document = next(local, None), next(remote, None)
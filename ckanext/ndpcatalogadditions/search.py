@@ -0,0 +1,137 @@
+import base64
+import contextlib
+import contextvars
+import json
+
+import ckan.logic as logic
+from ckan.lib import search as ckan_search
+from ckanext.ndp.metrics import timed, ckan_action_seconds
+
+
+def encode_cursor(sort_value, dataset_id):
+    data = json.dumps([sort_value, dataset_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, dataset_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return sort_value, dataset_id
+
+
+# sort fields holding timestamps, whose cursor values need solr_date
+DATE_FIELDS = {'metadata_created', 'metadata_modified'}
+
+
+def solr_date(value):
+    # package dicts hold naive ISO timestamps, the index expects UTC with a trailing Z
+    return value if value.endswith('Z') else value + 'Z'
+
+
+def keyset_filter(cursor, sort_field, descending=True):
+    """Solr filter selecting the rows after `cursor` in (sort_field, id) order."""
+    sort_value, dataset_id = decode_cursor(cursor)
+    sort_value = json.dumps(solr_date(sort_value) if sort_field in DATE_FIELDS else sort_value)
+    dataset_id = json.dumps(dataset_id)
+    if descending:
+        return (f'{sort_field}:[* TO {sort_value}}} OR '
+                f'({sort_field}:{sort_value} AND id:{{* TO {dataset_id}}})')
+    return (f'{sort_field}:{{{sort_value} TO *] OR '
+            f'({sort_field}:{sort_value} AND id:{{{dataset_id} TO *}})')
+
+
+def search_page(context, search_dict, rows, cursor=None, fields=None, sort_field='metadata_created',
+                descending=True, total=True):
+    """Run one page of a package_search with keyset pagination.
+
+    Rows are ordered by (sort_field, id), so a page never skips or repeats
+    datasets the way offset paging does when datasets are added meanwhile.
+    `fields` is passed to Solr as `fl` so only those attributes are
+    returned. Returns {'count', 'results', 'next_cursor'}, where `count` is
+    the total number of matching datasets. After the first page that takes
+    a second, rows=0 search; with `total=False` it is skipped and count is
+    None.
+    """
+    unkeyed = search_dict
+    direction = 'desc' if descending else 'asc'
+    search_dict = dict(search_dict, rows=rows, sort=f'{sort_field} {direction}, id {direction}')
+    if cursor:
+        fq = keyset_filter(cursor, sort_field, descending)
+        search_dict['fq'] = f"{search_dict['fq']} AND ({fq})" if search_dict.get('fq') else fq
+    if fields:
+        search_dict['fl'] = list(dict.fromkeys(list(fields) + [sort_field, 'id']))
+
+    with timed(ckan_action_seconds, 'package_search'):
+        result = logic.get_action('package_search')(context, search_dict)
+    count = result['count']
+    if cursor:
+        # the keyset filter narrows Solr's count to the datasets after the cursor
+        count = None
+        if total:
+            with timed(ckan_action_seconds, 'package_search'):
+                count = logic.get_action('package_search')(context, dict(unkeyed, rows=0))['count']
+    results = result['results']
+    next_cursor = None
+    if len(results) == rows and results:
+        last = results[-1]
+        next_cursor = encode_cursor(last[sort_field], last['id'])
+    if fields:
+        results = [{k: v for k, v in package.items() if k in fields} for package in results]
+    return {'count': count, 'results': results, 'next_cursor': next_cursor}
+
+
+def iter_search(context, search_dict, rows, cursor=None, fields=None, sort_field='metadata_created',
+                descending=True):
+    """Yield every matching dataset, fetching one page at a time."""
+    while True:
+        page = search_page(context, search_dict, rows, cursor, fields, sort_field, descending, total=False)
+        for package in page['results']:
+            yield package
+        cursor = page['next_cursor']
+        if not cursor:
+            return
+
+
+# set while the current thread (or task) writes datasets that it indexes itself
+_notifications_suppressed = contextvars.ContextVar('ndp_index_notifications_suppressed', default=False)
+
+
+def _install_notification_guard():
+    plugin = ckan_search.SynchronousSearchPlugin
+    if getattr(plugin.notify, 'ndp_guarded', False):
+        return
+    original = plugin.notify
+
+    def notify(self, entity, operation):
+        if _notifications_suppressed.get():
+            return
+        return original(self, entity, operation)
+    notify.ndp_guarded = True
+    plugin.notify = notify
+
+
+@contextlib.contextmanager
+def index_notifications_suppressed():
+    """Skip CKAN's synchronous search index update for the writes made in this block.
+
+    CKAN indexes, and commits Solr for, every dataset touched by a database
+    commit, including through the members, tags and extras it relates to.
+    Inside this block that update is skipped for the current thread only;
+    other requests of the process keep indexing as usual. The caller is
+    responsible for indexing (or removing) the datasets it wrote.
+    """
+    _install_notification_guard()
+    token = _notifications_suppressed.set(True)
+    try:
+        yield
+    finally:
+        _notifications_suppressed.reset(token)
+
+
+def index_without_commit(package_id):
+    """Index one dataset as CKAN's synchronous update would, but without a Solr commit."""
+    context = {'ignore_auth': True, 'use_cache': False, 'validate': False}
+    pkg_dict = logic.get_action('package_show')(context, {'id': package_id})
+    ckan_search.index_for('Package').update_dict(pkg_dict, defer_commit=True)
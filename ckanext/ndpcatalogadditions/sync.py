@@ -0,0 +1,65 @@
+import hashlib
+import json
+
+
+# dataset fields that production computes itself or that are synced separately
+IGNORED_FIELDS = {
+    'id', 'resources', 'metadata_created', 'metadata_modified', 'revision_id',
+    'num_resources', 'num_tags', 'state', 'creator_user_id', 'organization',
+}
+
+# resource fields that production computes itself
+IGNORED_RESOURCE_FIELDS = {'id', 'package_id', 'position', 'created', 'metadata_modified', 'revision_id'}
+
+
+def content_hash(value):
+    """Stable hash of a JSON-serializable value."""
+    data = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def resource_content(resource):
+    return {k: v for k, v in resource.items() if k not in IGNORED_RESOURCE_FIELDS}
+
+
+def field_hashes(dataset):
+    return {k: content_hash(v) for k, v in dataset.items() if k not in IGNORED_FIELDS}
+
+
+def dataset_hashes(remote_dataset, local_resource_ids, remote_resource_ids):
+    """Hashes recorded after a dataset is sent to production.
+
+    `remote_dataset` is the dict sent to production, `local_resource_ids`
+    the ids of its resources in Prekan and `remote_resource_ids` the ids
+    production gave them, in the same order.
+    """
+    resources = {}
+    for local_id, remote_id, resource in zip(local_resource_ids, remote_resource_ids,
+                                             remote_dataset.get('resources') or []):
+        resources[local_id] = {'remote_id': remote_id, 'hash': content_hash(resource_content(resource))}
+    return {'fields': field_hashes(remote_dataset), 'resources': resources}
+
+
+def plan_sync(hashes, remote_dataset, local_resource_ids):
+    """Work out the minimal production calls to bring a dataset up to date.
+
+    Returns a dict with the changed dataset fields (for package_patch) and
+    the resources to create, update and delete.
+    """
+    new_fields = field_hashes(remote_dataset)
+    old_fields = hashes.get('fields', {})
+    changed = {k: remote_dataset[k] for k, h in new_fields.items() if old_fields.get(k) != h}
+
+    old_resources = hashes.get('resources', {})
+    create, update = [], []
+    for local_id, resource in zip(local_resource_ids, remote_dataset.get('resources') or []):
+        content = resource_content(resource)
+        known = old_resources.get(local_id)
+        if known is None:
+            create.append((local_id, content))
+        elif known['hash'] != content_hash(content):
+            update.append((local_id, known['remote_id'], content))
+    delete = [(local_id, known['remote_id']) for local_id, known in old_resources.items()
+              if local_id not in local_resource_ids]
+
+    return {'fields': changed, 'create': create, 'update': update, 'delete': delete}
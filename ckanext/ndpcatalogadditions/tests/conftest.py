@@ -0,0 +1,29 @@
+"""Fixtures shared by the tests that call the /ndp endpoints."""
+
+import pytest
+
+from ckanext.ndpcatalogadditions.tests.stub_ckan import StubCkan
+from ckanext.ndpcatalogadditions.tests.stub_keycloak import StubKeycloak
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """A StubCkan as production and a StubKeycloak the extension verifies tokens against."""
+    # imported here so that the modules testing plain helpers do not need CKAN
+    import ckanext.ndpcatalogadditions.controller as controller
+
+    with StubCkan() as production, StubKeycloak(key_size=1024) as keycloak:
+        monkeypatch.setenv('CKANEXT__KEYCLOAK__SERVER_URL', keycloak.url)
+        monkeypatch.setenv('CKANEXT__KEYCLOAK__REALM_NAME', keycloak.realm)
+        monkeypatch.setattr(controller, 'ckan_url', production.url)
+        # production ids cached by an earlier test belong to another stub
+        for cache in (controller.remote_users, controller.remote_organizations,
+                      controller.remote_memberships, controller.creator_tokens):
+            cache.clear()
+        yield production, keycloak
+
+
+@pytest.fixture
+def approval_state(clean_db, migrate_db_for):
+    """A clean database with the extension's tables migrated."""
+    migrate_db_for('ndpcatalogadditions')
@@ -0,0 +1,44 @@
+"""Helpers calling the /ndp endpoints in tests."""
+
+import ckanext.ndpcatalogadditions.controller as controller
+
+
+ORGANIZATION = 'Test Org'
+SUBMITTER = 'submitter@example.org'
+REVIEWER = 'reviewer@example.org'
+
+
+def headers(keycloak, username, roles=()):
+    return {'Authorization': f'Bearer {keycloak.token(username, roles=roles)}'}
+
+
+def reviewer_headers(keycloak):
+    return headers(keycloak, REVIEWER, roles=sorted(controller.reviewer_roles))
+
+
+def dataset(name, **fields):
+    return dict({'name': name, 'title': name, 'owner_org': ORGANIZATION,
+                 'resources': [{'url': f'https://example.org/{name}.csv', 'name': 'data'}]}, **fields)
+
+
+def create_local(app, keycloak, name, **fields):
+    response = app.post('/ndp/package_create', json=dataset(name, **fields), headers=headers(keycloak, SUBMITTER))
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.json['id']
+
+
+def approve(app, keycloak, dataset_id):
+    return app.post('/ndp/package_approve', json={'id': dataset_id}, headers=reviewer_headers(keycloak))
+
+
+def fail_once(monkeypatch, name):
+    """Make controller.<name> raise on its first call only."""
+    original = getattr(controller, name)
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError(f'{name} failed')
+        return original(*args, **kwargs)
+    monkeypatch.setattr(controller, name, wrapper)
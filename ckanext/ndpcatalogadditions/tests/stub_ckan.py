@@ -0,0 +1,167 @@
+"""Local stub of the production CKAN action API."""
+
+import copy
+import json
+import re
+import threading
+import uuid
+from urllib.parse import parse_qsl, urlsplit
+
+from ckanext.ndpcatalogadditions.tests.stub_server import StubServer
+
+
+ACTIONS = (
+    'user_show', 'user_create',
+    'organization_show', 'organization_create', 'organization_member_create',
+    'api_token_create', 'api_token_revoke',
+    'package_create', 'package_show', 'package_patch', 'package_search',
+    'resource_create', 'resource_patch', 'resource_delete',
+)
+
+
+def not_found():
+    return 404, {'success': False, 'error': {'__type': 'Not Found Error', 'message': 'Not Found'}}
+
+
+class StubCkan(StubServer):
+    """In-memory CKAN catalog answering the actions the extension calls.
+
+    Users, organizations, datasets and API tokens live in dicts on the instance, so
+    tests can seed or inspect them directly. `package_search` supports
+    `rows`, `start`, `sort` on one field (with `id` as tie-breaker), `fl`
+    and, in `fq`, the `name:{"<name>" TO *]` filter of keyset paging.
+    `latency` delays every response, as with `StubServer`.
+    """
+
+    def __init__(self, latency=0, error_status=None):
+        self.users = {}
+        self.organizations = {}
+        self.members = set()
+        self.datasets = {}
+        # token -> the api_token_create request that issued it
+        self.tokens = {}
+        self._lock = threading.Lock()
+        routes = {f'/api/3/action/{action}': self._route(action) for action in ACTIONS}
+        super().__init__(routes, latency=latency, error_status=error_status)
+
+    def _route(self, action):
+        handler = getattr(self, action)
+
+        def route(method, path, body):
+            data = dict(parse_qsl(urlsplit(path).query))
+            if body:
+                try:
+                    data.update(json.loads(body))
+                except ValueError:
+                    # multipart file uploads are accepted but not stored
+                    pass
+            with self._lock:
+                result = handler(data)
+            if isinstance(result, tuple):
+                return result
+            return 200, {'success': True, 'result': copy.deepcopy(result)}
+        return route
+
+    def action_calls(self, action):
+        return sum(1 for method, path in self.requests if path == f'/api/3/action/{action}')
+
+    def _find(self, objects, id_or_name):
+        if id_or_name in objects:
+            return objects[id_or_name]
+        return next((o for o in objects.values() if o['name'] == id_or_name), None)
+
+    def user_show(self, data):
+        return self._find(self.users, data.get('id')) or not_found()
+
+    def user_create(self, data):
+        user = {'id': str(uuid.uuid4()), 'name': data['name'], 'email': data.get('email'),
+                'fullname': data.get('fullname')}
+        self.users[user['id']] = user
+        return user
+
+    def organization_show(self, data):
+        return self._find(self.organizations, data.get('id')) or not_found()
+
+    def organization_create(self, data):
+        organization = {'id': str(uuid.uuid4()), 'name': data['name'], 'title': data.get('title'),
+                        'description': data.get('description')}
+        self.organizations[organization['id']] = organization
+        return organization
+
+    def organization_member_create(self, data):
+        self.members.add((data['id'], data['username'], data.get('role')))
+        return {'group_id': data['id'], 'username': data['username'], 'capacity': data.get('role')}
+
+    def api_token_create(self, data):
+        token = uuid.uuid4().hex
+        self.tokens[token] = data
+        return {'token': token}
+
+    def api_token_revoke(self, data):
+        self.tokens.pop(data.get('token'), None)
+        return None
+
+    def _resource(self, package_id, resource):
+        return dict(resource, id=resource.get('id') or str(uuid.uuid4()), package_id=package_id)
+
+    def package_create(self, data):
+        if self._find(self.datasets, data.get('name')):
+            return 409, {'success': False, 'error': {'__type': 'Validation Error', 'name': ['That URL is already in use.']}}
+        dataset = dict(data, id=str(uuid.uuid4()))
+        dataset['resources'] = [self._resource(dataset['id'], r) for r in data.get('resources') or []]
+        self.datasets[dataset['id']] = dataset
+        return dataset
+
+    def package_show(self, data):
+        return self._find(self.datasets, data.get('id')) or not_found()
+
+    def package_patch(self, data):
+        dataset = self._find(self.datasets, data.get('id'))
+        if dataset is None:
+            return not_found()
+        dataset.update((k, v) for k, v in data.items() if k != 'id')
+        return dataset
+
+    def package_search(self, data):
+        datasets = list(self.datasets.values())
+        after = re.search(r'name:\{("(?:[^"\\]|\\.)*") TO \*\]', data.get('fq') or '')
+        if after:
+            datasets = [d for d in datasets if d['name'] > json.loads(after.group(1))]
+        sort = (data.get('sort') or 'name asc').split(',')[0].split()
+        datasets.sort(key=lambda d: (str(d.get(sort[0]) or ''), d['id']), reverse=sort[-1] == 'desc')
+        start = int(data.get('start') or 0)
+        page = datasets[start:start + int(data.get('rows') or 10)]
+        fields = data.get('fl')
+        if fields:
+            fields = fields.split(',') if isinstance(fields, str) else fields
+            page = [{k: d[k] for k in fields if k in d} for d in page]
+        return {'count': len(datasets), 'results': page}
+
+    def _find_resource(self, resource_id):
+        for dataset in self.datasets.values():
+            for resource in dataset['resources']:
+                if resource['id'] == resource_id:
+                    return dataset, resource
+        return None, None
+
+    def resource_create(self, data):
+        dataset = self._find(self.datasets, data.get('package_id'))
+        if dataset is None:
+            return not_found()
+        resource = self._resource(dataset['id'], data)
+        dataset['resources'].append(resource)
+        return resource
+
+    def resource_patch(self, data):
+        dataset, resource = self._find_resource(data.get('id'))
+        if resource is None:
+            return not_found()
+        resource.update(data)
+        return resource
+
+    def resource_delete(self, data):
+        dataset, resource = self._find_resource(data.get('id'))
+        if resource is None:
+            return not_found()
+        dataset['resources'].remove(resource)
+        return None
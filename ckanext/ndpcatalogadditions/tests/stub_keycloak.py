@@ -0,0 +1,44 @@
+"""Local stub Keycloak serving a JWKS and issuing signed test tokens."""
+
+import time
+import uuid
+
+import rsa
+from jose import jwk, jwt
+
+from ckanext.ndpcatalogadditions.tests.stub_server import StubServer
+
+
+class StubKeycloak(StubServer):
+    """Keycloak realm whose certs endpoint publishes one generated RSA key.
+
+    `token(username, roles)` returns an RS256 token signed with that key and
+    carrying the claims `keycloak_token.extract_user_info` reads. Point
+    `CKANEXT__KEYCLOAK__SERVER_URL` at `url` and `CKANEXT__KEYCLOAK__REALM_NAME`
+    at `realm` to have the extension verify it.
+    """
+
+    def __init__(self, realm='ndp', key_size=2048, latency=0):
+        self.realm = realm
+        self.kid = uuid.uuid4().hex
+        public_key, private_key = rsa.newkeys(key_size)
+        self.private_key = private_key.save_pkcs1().decode('ascii')
+        self.jwk = dict(jwk.construct(public_key.save_pkcs1(), 'RS256').to_dict(), kid=self.kid, use='sig')
+        certs = f'/realms/{realm}/protocol/openid-connect/certs'
+        super().__init__({certs: lambda method, path, body: (200, {'keys': [self.jwk]})}, latency=latency)
+
+    def token(self, username, roles=(), ttl=3600, email=None, name=None):
+        now = int(time.time())
+        claims = {
+            'iss': f'{self.url}/realms/{self.realm}',
+            'aud': 'account',
+            'iat': now,
+            'exp': now + ttl,
+            'preferred_username': username,
+            'email': email or (username if '@' in username else f'{username}@example.org'),
+            'name': name or username,
+            'given_name': name or username,
+            'family_name': '',
+            'realm_access': {'roles': list(roles)},
+        }
+        return jwt.encode(claims, self.private_key, algorithm='RS256', headers={'kid': self.kid})
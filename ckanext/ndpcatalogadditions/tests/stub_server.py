@@ -0,0 +1,61 @@
+"""Local stub HTTP server for exercising upstream calls in tests."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """Serves canned JSON responses with injectable latency and errors.
+
+    `routes` maps a path to a callable taking (method, path, body) and
+    returning (status, payload). `latency` and `error_status` apply to every
+    request and can be changed while the server is running.
+    """
+
+    def __init__(self, routes=None, latency=0, error_status=None):
+        self.routes = routes or {}
+        self.latency = latency
+        self.error_status = error_status
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                path = self.path.split('?')[0]
+                stub.requests.append((self.command, path))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.error_status:
+                    status, payload = stub.error_status, {'success': False}
+                elif path in stub.routes:
+                    status, payload = stub.routes[path](self.command, self.path, body)
+                else:
+                    status, payload = 404, {'success': False, 'error': {'message': 'Not Found'}}
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,154 @@
+"""Tests for approval_state.py and the checkpointed approval in controller.py."""
+
+import json
+import threading
+import time
+
+import pytest
+
+import ckan.model as model
+
+import ckanext.ndpcatalogadditions.controller as controller
+from ckanext.ndpcatalogadditions.approval_state import approval_states
+from ckanext.ndpcatalogadditions.tests.endpoints import approve, create_local, fail_once, reviewer_headers
+
+
+@pytest.mark.usefixtures("approval_state")
+def test_checkpoint_is_stored_in_the_migrated_table_and_can_be_rewound():
+    checkpoint = controller.ApprovalCheckpoint.load('d1')
+    checkpoint.advance('remote_dataset_requested', remote_org_id='o1', local_org_id='l1')
+    checkpoint.rewind('membership_ensured')
+
+    loaded = controller.ApprovalCheckpoint.load('d1')
+    assert loaded.state == 'membership_ensured'
+    assert (loaded.data['remote_org_id'], loaded.data['local_org_id']) == ('o1', 'l1')
+    assert approval_states(['d1', 'd2']) == {'d1': 'membership_ensured'}
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+@pytest.mark.parametrize('failing_step', ['record_remote_dataset', 'delete_approved_dataset'])
+def test_approval_resumes_without_a_second_production_copy(app, stubs, monkeypatch, failing_step):
+    production, keycloak = stubs
+    dataset_id = create_local(app, keycloak, 'resume-me')
+    fail_once(monkeypatch, failing_step)
+
+    assert approve(app, keycloak, dataset_id).status_code == 401
+    response = approve(app, keycloak, dataset_id)
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert production.action_calls('package_create') == 1
+    [remote] = production.datasets.values()
+    assert controller.extra_value(remote, controller.SOURCE_EXTRA) == dataset_id
+    assert model.Package.get(dataset_id).state == 'deleted'
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_unrelated_production_dataset_with_the_same_name_is_not_adopted(app, stubs):
+    production, keycloak = stubs
+    unrelated = {'id': 'unrelated', 'name': 'taken', 'owner_org': 'elsewhere',
+                 'resources': [{'id': 'unrelated-resource', 'url': 'https://example.org/other.csv'}]}
+    production.datasets['unrelated'] = json.loads(json.dumps(unrelated))
+    dataset_id = create_local(app, keycloak, 'taken')
+
+    assert approve(app, keycloak, dataset_id).status_code == 401
+    # production rejected the create, so the next attempt does not look for an earlier copy
+    assert controller.ApprovalCheckpoint.load(dataset_id).state == 'membership_ensured'
+
+    # even when an earlier attempt may have created it, a dataset from elsewhere is left alone
+    controller.ApprovalCheckpoint.load(dataset_id).advance('remote_dataset_requested')
+    assert approve(app, keycloak, dataset_id).status_code == 401
+
+    assert production.datasets == {'unrelated': unrelated}
+    assert controller.ApprovalCheckpoint.load(dataset_id).data.get('remote_dataset_id') is None
+    assert model.Package.get(dataset_id).state == 'active'
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_batch_approval_pushes_in_parallel_isolates_failures_and_keeps_the_order(app, stubs, monkeypatch):
+    production, keycloak = stubs
+    monkeypatch.setattr(controller, 'approve_batch_workers', 3)
+    ids = [create_local(app, keycloak, f'batch-{i}') for i in range(5)]
+    push_remote_dataset = controller.push_remote_dataset
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def slow_push(remote_user, dataset, *args, **kwargs):
+        with lock:
+            running.append(dataset['name'])
+            peak.append(len(running))
+        try:
+            time.sleep(0.2)
+            if dataset['name'] == 'batch-1':
+                raise RuntimeError('production refused batch-1')
+            return push_remote_dataset(remote_user, dataset, *args, **kwargs)
+        finally:
+            with lock:
+                running.remove(dataset['name'])
+    monkeypatch.setattr(controller, 'push_remote_dataset', slow_push)
+    requested = [ids[4], 'missing', ids[0], ids[1], ids[2], ids[3]]
+
+    response = app.post('/ndp/package_approve_batch', json={'ids': requested}, headers=reviewer_headers(keycloak))
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    results = response.json['results']
+    assert [r['id'] for r in results] == requested
+    assert [r['success'] for r in results] == [True, False, True, False, True, True]
+    assert 'batch-1' in results[3]['error']
+    assert max(peak) == 3
+    # the creator and organization are resolved once for the whole batch
+    assert production.action_calls('user_create') == 1
+    assert production.action_calls('organization_create') == 1
+    assert sorted(d['name'] for d in production.datasets.values()) == ['batch-0', 'batch-2', 'batch-3', 'batch-4']
+    assert model.Package.get(ids[1]).state == 'active'
+    assert controller.ApprovalCheckpoint.load(ids[1]).state == 'remote_dataset_requested'
+    assert {model.Package.get(i).state for i in ids if i != ids[1]} == {'deleted'}
+
+
+def meet_at(barrier, fn):
+    """Wrap fn so that it only proceeds once every party of the barrier has called it."""
+    def wrapper(*args):
+        barrier.wait()
+        return fn(*args)
+    return wrapper
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_remote_user_and_organization_are_looked_up_concurrently(app, stubs, monkeypatch):
+    production, keycloak = stubs
+    dataset, checkpoint = controller.load_dataset_for_approval(create_local(app, keycloak, 'owned'))
+    # each lookup waits for the other one, so running them one after the other breaks the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    for name in ('get_or_create_remote_user', 'get_remote_organization'):
+        monkeypatch.setattr(controller, name, meet_at(barrier, getattr(controller, name)))
+
+    remote_user, remote_organization = controller.resolve_remote_owner(dataset, checkpoint)
+
+    assert [u['name'] for u in production.users.values()] == [remote_user['name']]
+    assert (remote_organization['id'], remote_user['name'], 'editor') in production.members
+    assert controller.ApprovalCheckpoint.load(dataset['id']).state == 'membership_ensured'
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_failed_organization_lookup_is_raised_and_keeps_only_the_user_step(app, stubs, monkeypatch):
+    production, keycloak = stubs
+    dataset, checkpoint = controller.load_dataset_for_approval(create_local(app, keycloak, 'orphaned'))
+
+    def unavailable(organization):
+        raise RuntimeError('organization_show failed')
+    monkeypatch.setattr(controller, 'get_remote_organization', unavailable)
+
+    with pytest.raises(RuntimeError, match='organization_show failed'):
+        controller.resolve_remote_owner(dataset, checkpoint)
+
+    loaded = controller.ApprovalCheckpoint.load(dataset['id'])
+    assert loaded.state == 'remote_user_ensured'
+    assert loaded.data['remote_user_name'] and loaded.data['remote_org_id'] is None
+    assert production.members == set()
+    # the production ids cached for the creator are dropped after a failure
+    assert controller.remote_users.get(model.User.get(dataset['creator_user_id']).name) is None
@@ -0,0 +1,105 @@
+"""Tests for cache.py."""
+
+import time
+
+import pytest
+
+import ckanext.ndpcatalogadditions.cache as cache_module
+from ckanext.ndpcatalogadditions.cache import TTLCache, RedisCache
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(ttl=60)
+    cache.set('fresh', 1)
+    cache.set('stale', 2, ttl=-1)
+
+    assert cache.get('fresh') == 1
+    assert cache.get('stale') is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+
+def test_redis_cache_round_trips_values_per_namespace():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis()
+    users = RedisCache(client, 'remote_users', ttl=60)
+    memberships = RedisCache(client, 'remote_memberships', ttl=60)
+
+    users.set('alice', {'id': 'u1', 'name': 'alice'})
+    memberships.set(('org1', 'alice'), True)
+
+    assert users.get('alice') == {'id': 'u1', 'name': 'alice'}
+    assert memberships.get(('org1', 'alice')) is True
+    assert memberships.get('alice') is None
+    assert 0 < client.pttl('ndp:remote_users:alice') <= 60000
+
+
+def test_redis_cache_is_shared_between_workers():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    worker_a = RedisCache(fakeredis.FakeRedis(server=server), 'remote_users', ttl=60)
+    worker_b = RedisCache(fakeredis.FakeRedis(server=server), 'remote_users', ttl=60)
+
+    worker_a.set('alice', {'id': 'remote-alice'})
+
+    assert worker_b.get('alice') == {'id': 'remote-alice'}
+    worker_b.clear()
+    assert worker_a.get('alice') is None
+
+
+def test_memory_backend_can_be_forced_for_one_cache(monkeypatch):
+    monkeypatch.setattr(cache_module, 'cache_backend', 'redis')
+    monkeypatch.setattr(cache_module, '_redis_client', object())
+    monkeypatch.setattr(cache_module, '_caches', {})
+
+    assert isinstance(cache_module.get_cache('ndp_test_secrets', backend='memory'), TTLCache)
+    assert isinstance(cache_module.get_cache('ndp_test_shared'), RedisCache)
+
+
+def test_redis_cache_treats_redis_errors_as_misses():
+    class Down:
+        def get(self, key):
+            raise ConnectionError('down')
+
+    cache = RedisCache(Down(), 'remote_users')
+
+    assert cache.get('alice') is None
+    assert cache.stats()['errors'] == 1
+
+
+def test_invalidate_reaches_memory_caches_of_other_workers(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    monkeypatch.setattr(cache_module, 'cache_redis_url', 'redis://stub')
+    monkeypatch.setattr(cache_module, '_listener', None)
+    monkeypatch.setattr(cache_module, '_caches', {})
+    monkeypatch.setattr(cache_module, 'invalidation_hooks', [])
+    cache_module.set_redis_client(fakeredis.FakeRedis())
+    try:
+        memberships = cache_module.get_cache('remote_memberships', ttl=60)
+        memberships.set(('org1', 'alice'), True)
+        seen = []
+        cache_module.on_invalidate(lambda namespace, key: seen.append((namespace, key)))
+        cache_module.start_invalidation_listener()
+
+        # published by another worker: only the Redis message reaches this one
+        cache_module.redis_client().publish(cache_module.INVALIDATION_CHANNEL,
+                                            cache_module.dumps(['remote_memberships', ['org1', 'alice']]))
+        for _ in range(100):
+            if seen:
+                break
+            time.sleep(0.01)
+
+        assert seen == [('remote_memberships', ('org1', 'alice'))]
+        assert memberships.get(('org1', 'alice')) is None
+    finally:
+        cache_module.set_redis_client(None)
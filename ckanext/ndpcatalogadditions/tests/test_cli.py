@@ -0,0 +1,92 @@
+"""Tests for the helpers of cli.py."""
+
+import datetime
+import json
+
+import click
+import pytest
+from click.testing import CliRunner
+
+import ckan.logic as logic
+import ckan.tests.factories as factories
+
+from ckanext.ndpcatalogadditions.approval_state import ApprovalCheckpoint
+import ckanext.ndpcatalogadditions.cli as cli
+from ckanext.ndpcatalogadditions.cli import batches, iter_approved, promote_filters, read_checkpoint
+
+
+def test_promote_filters_combine_organizations_and_dates():
+    fq = promote_filters(('org-a', 'org-b'), (), datetime.datetime(2024, 1, 1), None)
+
+    assert fq == ('organization:("org-a" OR "org-b") AND '
+                  'metadata_created:[2024-01-01T00:00:00Z TO *]')
+
+
+def test_read_checkpoint_skips_failures_and_truncated_lines(tmp_path):
+    path = tmp_path / 'promote.jsonl'
+    path.write_text(json.dumps({'id': 'a', 'success': True}) + '\n'
+                    + json.dumps({'id': 'b', 'success': False, 'error': 'boom'}) + '\n'
+                    + '{"id": "c", "succ')
+
+    assert read_checkpoint(str(path)) == {'a'}
+    assert read_checkpoint(str(tmp_path / 'missing.jsonl')) == set()
+
+
+def test_batches_keep_the_last_partial_batch():
+    assert list(batches(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.usefixtures("approval_state", "clean_index")
+def test_iter_approved_reads_deleted_approved_datasets_from_the_database():
+    sysadmin = factories.Sysadmin()
+    organization = factories.Organization()
+    other = factories.Organization()
+    context = {'user': sysadmin['name']}
+    approved = [factories.Dataset(name=name, owner_org=organization['id'], tags=[{'name': 'x'}])
+                for name in ('b-approved', 'a-approved', 'a_approved')]
+    factories.Dataset(name='not-approved', owner_org=organization['id'])
+    elsewhere = factories.Dataset(name='elsewhere', owner_org=other['id'])
+    for package in approved + [elsewhere]:
+        ApprovalCheckpoint(package['id']).advance('local_dataset_deleted')
+        logic.get_action('package_delete')(dict(context), {'id': package['id']})
+
+    documents = list(iter_approved(context, [organization['name']], rows=2))
+
+    # code point order, as Solr sorts production's names
+    assert [d['name'] for d in documents] == ['a-approved', 'a_approved', 'b-approved']
+    assert all(d['organization'] == organization['name'] and d['tags'] == ['x'] for d in documents)
+    assert len(list(iter_approved(context, (), rows=2))) == 4
+
+
+@pytest.mark.usefixtures("clean_db", "clean_index")
+def test_promote_progress_covers_the_datasets_skipped_from_the_checkpoint(tmp_path, monkeypatch):
+    datasets = [factories.Dataset() for _ in range(3)]
+    checkpoint = tmp_path / 'promote.jsonl'
+    checkpoint.write_text(json.dumps({'id': datasets[0]['id'], 'success': True}) + '\n')
+    approved = []
+    progress = []
+    progressbar = click.progressbar
+
+    def approve_datasets(dataset_ids, workers=None):
+        approved.extend(dataset_ids)
+        return [{'id': dataset_id, 'success': True, 'result': {'id': 'remote'}} for dataset_id in dataset_ids]
+
+    def recording_progressbar(*args, **kwargs):
+        bar = progressbar(*args, **kwargs)
+        update = bar.update
+
+        def recording_update(n_steps, *rest):
+            progress.append(n_steps)
+            update(n_steps, *rest)
+        bar.update = recording_update
+        progress.append(('length', kwargs['length']))
+        return bar
+    monkeypatch.setattr(cli, 'approve_datasets', approve_datasets)
+    monkeypatch.setattr(cli.click, 'progressbar', recording_progressbar)
+
+    result = CliRunner().invoke(cli.promote, ['--checkpoint', str(checkpoint), '--batch-size', '2'])
+
+    assert result.exit_code == 0, result.output
+    assert sorted(approved) == sorted(d['id'] for d in datasets[1:])
+    assert progress[0] == ('length', 3) and sum(progress[1:]) == 3
+    assert 'Promoted 2 datasets, 0 failed, 1 skipped from the checkpoint.' in result.output
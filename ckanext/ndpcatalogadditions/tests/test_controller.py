@@ -0,0 +1,342 @@
+"""Tests for the endpoints of controller.py.
+
+Keycloak and the production CKAN are replaced by the local stubs (the
+`stubs` fixture in conftest.py), as in `benchmarks/bench_endpoints.py`.
+"""
+
+import concurrent.futures
+import datetime
+import json
+
+import pytest
+
+import ckan.logic as logic
+import ckan.model as model
+from ckan.lib import search
+import ckan.tests.factories as factories
+
+import ckanext.ndpcatalogadditions.controller as controller
+from ckanext.ndpcatalogadditions.tests.endpoints import (SUBMITTER, approve, create_local, dataset, headers,
+                                                        reviewer_headers)
+from ckanext.ndpcatalogadditions.tests.stub_ckan import StubCkan
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_resubmitted_dataset_moved_to_another_organization_moves_in_production(app, stubs):
+    production, keycloak = stubs
+    dataset_id = create_local(app, keycloak, 'moving')
+    assert approve(app, keycloak, dataset_id).status_code == 200
+
+    # resubmitted in another organization
+    sysadmin = factories.Sysadmin()
+    organization = factories.Organization()
+    logic.get_action('package_patch')({'user': sysadmin['name'], 'ignore_auth': True},
+                                      {'id': dataset_id, 'state': 'active', 'owner_org': organization['id']})
+    response = approve(app, keycloak, dataset_id)
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    remote_organization = next(o for o in production.organizations.values() if o['name'] == organization['name'])
+    [remote] = production.datasets.values()
+    assert remote['owner_org'] == remote_organization['id']
+    assert any(member[0] == remote_organization['id'] and member[2] == 'editor' for member in production.members)
+    checkpoint = controller.ApprovalCheckpoint.load(dataset_id)
+    assert checkpoint.data['local_org_id'] == organization['id']
+    assert checkpoint.data['remote_org_id'] == remote_organization['id']
+
+
+def test_creator_tokens_are_issued_once_with_an_expiry_and_revoked(monkeypatch):
+    with StubCkan(latency=0.05) as production:
+        monkeypatch.setattr(controller, 'ckan_url', production.url)
+        controller.creator_tokens.clear()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            tokens = set(executor.map(lambda i: controller.get_creator_token('creator'), range(8)))
+
+        assert len(tokens) == 1
+        assert production.action_calls('api_token_create') == 1
+        [issued] = production.tokens.values()
+        assert issued['expires_in'] == controller.creator_token_ttl + controller.creator_token_grace
+
+        controller.revoke_creator_token('creator')
+
+        assert production.tokens == {}
+        assert controller.creator_tokens.get('creator') is None
+
+
+def test_missing_local_upload_fails_the_transfer(monkeypatch):
+    monkeypatch.setattr(controller, 'local_upload_path', lambda resource: None)
+    checkpoint = controller.ApprovalCheckpoint('d1', {'state': 'remote_dataset_created', 'content_hashes': json.dumps({
+        'resources': {'r1': {'remote_id': 'remote-r1', 'hash': 'x'}}, 'pending_uploads': ['r1']})})
+    monkeypatch.setattr(checkpoint, 'advance', lambda *args, **kwargs: pytest.fail('checkpoint advanced'))
+    dataset = {'id': 'd1', 'resources': [{'id': 'r1', 'url_type': 'upload', 'url': 'data.csv'}]}
+
+    with pytest.raises(ValueError):
+        controller.transfer_uploaded_files(dataset, checkpoint)
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_membership_and_sysadmin_changes_drop_the_cached_entries():
+    sysadmin = factories.Sysadmin()
+    user = factories.User()
+    organization = factories.Organization(users=[{'name': user['name'], 'capacity': 'editor'}])
+    controller.ensure_editor_membership(model.User.get(user['id']), model.Group.get(organization['id']))
+    key = (user['id'], organization['id'])
+    assert controller.membership_cache.get(key) == 'editor'
+    controller.sysadmin_flags.set(user['name'], False)
+
+    logic.get_action('organization_member_delete')({'user': sysadmin['name']},
+                                                   {'id': organization['id'], 'username': user['name']})
+    user_obj = model.User.get(user['id'])
+    user_obj.sysadmin = True
+    model.Session.commit()
+
+    assert controller.membership_cache.get(key) is None
+    assert controller.sysadmin_flags.get(user['name']) is None
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_unrelated_user_and_membership_updates_keep_the_cached_entries(monkeypatch):
+    user = factories.User()
+    organization = factories.Organization(users=[{'name': user['name'], 'capacity': 'editor'}])
+    key = (user['id'], organization['id'])
+    published = []
+    monkeypatch.setattr(controller, 'invalidate', lambda namespace, key: published.append((namespace, key)))
+
+    user_obj = model.User.get(user['id'])
+    user_obj.last_active = datetime.datetime.utcnow()
+    user_obj.fullname = 'Renamed'
+    model.Session.commit()
+    assert published == []
+
+    member = model.Session.query(model.Member).filter_by(table_id=user['id'], group_id=organization['id']).one()
+    member.capacity = 'admin'
+    model.Session.commit()
+    assert published == [('memberships', key)]
+
+    user_obj.sysadmin = True
+    model.Session.commit()
+    assert published[1:] == [('sysadmin_flags', user['name'])]
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_malformed_ndjson_line_fails_only_that_dataset(app, stubs):
+    production, keycloak = stubs
+    body = '\n'.join([json.dumps(dataset('batch-a')), '{"name": "batch-b", ',
+                      json.dumps(dataset('batch-c'))])
+
+    response = app.post('/ndp/package_create_batch', data=body, content_type='application/x-ndjson',
+                        headers=headers(keycloak, 'submitter@example.org'))
+
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [(r['index'], r['success']) for r in results] == [(0, True), (1, False), (2, True)]
+    assert model.Package.get('batch-a') is not None
+    assert model.Package.get('batch-c') is not None
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_batch_indexes_each_dataset_once_and_commits_the_index_once(app, stubs, monkeypatch):
+    production, keycloak = stubs
+    package_index = search.index.PackageSearchIndex
+    indexed = []
+    commits = []
+    index_package = package_index.index_package
+    commit = package_index.commit
+
+    def counting_index_package(self, pkg_dict, defer_commit=False):
+        indexed.append((pkg_dict['name'], defer_commit))
+        return index_package(self, pkg_dict, defer_commit=defer_commit)
+
+    def counting_commit(self):
+        commits.append(True)
+        return commit(self)
+
+    monkeypatch.setattr(package_index, 'index_package', counting_index_package)
+    monkeypatch.setattr(package_index, 'commit', counting_commit)
+    datasets = [dataset(f'indexed-{i}') for i in range(5)]
+
+    response = app.post('/ndp/package_create_batch', json={'datasets': datasets},
+                        headers=headers(keycloak, 'submitter@example.org'))
+
+    assert response.status_code == 200
+    assert sorted(indexed) == sorted((d['name'], True) for d in datasets)
+    assert len(commits) == 1
+    assert search.query_for(model.Package).run({'q': 'name:indexed-*'})['count'] == 5
+
+
+def reject_batch(app, keycloak, ids, roles=('ndp-reviewer',)):
+    return app.post('/ndp/package_reject_batch', json={'ids': ids},
+                    headers=headers(keycloak, 'reviewer@example.org', roles=roles))
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_reject_batch_requires_a_reviewer(app, stubs):
+    production, keycloak = stubs
+    dataset_id = create_local(app, keycloak, 'not-rejected')
+
+    response = reject_batch(app, keycloak, [dataset_id], roles=())
+
+    assert response.status_code == 401
+    assert model.Package.get(dataset_id) is not None
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_reject_batch_purges_what_it_can_and_reports_the_rest(app, stubs, monkeypatch):
+    production, keycloak = stubs
+    monkeypatch.setattr(controller, 'reviewer_roles', {'ndp-reviewer'})
+    first, failing, related = (create_local(app, keycloak, name) for name in ('first', 'failing', 'related'))
+    sysadmin = factories.Sysadmin()
+    logic.get_action('package_relationship_create')(
+        {'user': sysadmin['name']}, {'subject': related, 'object': first, 'type': 'depends_on'})
+    purge_dataset_rows = controller.purge_dataset_rows
+
+    def purge_or_fail(package):
+        if package.id == failing:
+            raise RuntimeError('purge failed')
+        purge_dataset_rows(package)
+    monkeypatch.setattr(controller, 'purge_dataset_rows', purge_or_fail)
+
+    response = reject_batch(app, keycloak, [first, 'missing', failing, related])
+
+    assert response.status_code == 200
+    statuses = {r['id']: r['success'] for r in response.json['results']}
+    assert statuses == {first: True, 'missing': False, failing: False, related: True}
+    assert model.Package.get(first) is None and model.Package.get(related) is None
+    assert model.Package.get(failing) is not None
+    assert model.Session.query(model.Member).filter(model.Member.table_id.in_([first, related])).count() == 0
+    found = search.query_for(model.Package).run({'q': '*:*', 'fl': 'id'})['results']
+    assert [d['id'] for d in found] == [failing]
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_my_package_list_answers_304_until_the_datasets_change(app, stubs):
+    production, keycloak = stubs
+    create_local(app, keycloak, 'polled')
+    submitter = headers(keycloak, SUBMITTER)
+
+    first = app.get('/ndp/my_package_list', headers=submitter)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and [d['name'] for d in first.json['results']] == ['polled']
+
+    for sent in (etag, 'W/' + etag, f'"other", {etag}'):
+        response = app.get('/ndp/my_package_list', headers=dict(submitter, **{'If-None-Match': sent}))
+        assert response.status_code == 304, sent
+        assert response.headers['ETag'] == etag
+        assert response.get_data() == b''
+
+    other_page = app.get('/ndp/my_package_list?rows=1', headers=dict(submitter, **{'If-None-Match': etag}))
+    assert other_page.status_code == 200
+
+    create_local(app, keycloak, 'polled-again')
+    changed = app.get('/ndp/my_package_list', headers=dict(submitter, **{'If-None-Match': etag}))
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_my_package_list_streams_every_page_as_ndjson(app, stubs):
+    production, keycloak = stubs
+    names = {f'streamed-{i}' for i in range(5)}
+    for name in names:
+        create_local(app, keycloak, name)
+
+    response = app.get('/ndp/my_package_list?format=ndjson&rows=2&fields=id,name',
+                       headers=headers(keycloak, SUBMITTER))
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['ETag']
+    documents = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert {d['name'] for d in documents} == names
+    assert all(set(d) == {'id', 'name'} for d in documents)
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_review_queue_pages_oldest_first_with_facets_and_an_organization_filter(app, stubs):
+    production, keycloak = stubs
+    controller.review_queue_facet_cache.clear()
+    names = [f'queued-{i}' for i in range(5)]
+    for i, name in enumerate(names):
+        create_local(app, keycloak, name, owner_org='Other Org' if i % 2 else 'Test Org')
+    reviewer = reviewer_headers(keycloak)
+
+    pages = []
+    cursor = ''
+    while cursor is not None:
+        response = app.get(f'/ndp/review_queue?rows=2&cursor={cursor}', headers=reviewer)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        pages.append(response.json)
+        cursor = response.json['next_cursor']
+
+    assert [len(page['results']) for page in pages] == [2, 2, 1]
+    assert [d['name'] for page in pages for d in page['results']] == names
+    # every page counts the whole queue, not only what follows its cursor
+    assert {page['count'] for page in pages} == {5}
+    assert set(pages[0]['results'][0]) == set(controller.REVIEW_QUEUE_FIELDS)
+    other = pages[0]['results'][1]['organization']
+    facets = pages[0]['facets']
+    assert sorted(facets['organization'].values()) == [2, 3] and facets['organization'][other] == 2
+
+    filtered = app.get(f'/ndp/review_queue?organization={other}&fields=name', headers=reviewer).json
+    assert filtered['count'] == 2
+    assert filtered['results'] == [{'name': 'queued-1'}, {'name': 'queued-3'}]
+    assert filtered['facets']['organization'] == {other: 2}
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_review_queue_requires_a_reviewer(app, stubs):
+    production, keycloak = stubs
+
+    response = app.get('/ndp/review_queue', headers=headers(keycloak, SUBMITTER))
+
+    assert response.status_code == 401
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+@pytest.mark.parametrize('caller, roles, expected', [
+    ('sysadmin', (), 200),
+    ('anyone', ('ndp-sysadmin',), 200),
+    ('anyone', ('ndp-reviewer',), 200),
+    ('listed', (), 200),
+    ('org-admin', (), 401),
+    ('editor', (), 401),
+    ('anyone', ('offline_access',), 401),
+    (None, (), 401),
+])
+def test_only_reviewers_and_sysadmins_can_review(app, stubs, monkeypatch, caller, roles, expected):
+    production, keycloak = stubs
+    monkeypatch.setattr(controller, 'reviewer_roles', {'ndp-reviewer'})
+    monkeypatch.setattr(controller, 'sysadmin_roles', {'ndp-sysadmin'})
+    monkeypatch.setattr(controller, 'reviewer_usernames', {'listed_example_org'})
+    controller.sysadmin_flags.clear()
+    factories.Sysadmin(name='sysadmin_example_org')
+    users = [{'name': factories.User(name='org-admin_example_org')['name'], 'capacity': 'admin'},
+             {'name': factories.User(name='editor_example_org')['name'], 'capacity': 'editor'}]
+    factories.Organization(users=users)
+
+    caller_headers = headers(keycloak, f'{caller}@example.org', roles=roles) if caller else {}
+    response = app.get('/ndp/review_queue', headers=caller_headers)
+
+    assert response.status_code == expected, response.get_data(as_text=True)
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+def test_upstream_status_is_only_shown_to_reviewers(app, stubs):
+    production, keycloak = stubs
+
+    refused = app.get('/ndp/upstream_status', headers=headers(keycloak, SUBMITTER))
+    shown = app.get('/ndp/upstream_status', headers=reviewer_headers(keycloak))
+
+    assert refused.status_code == 401
+    assert shown.status_code == 200
+    assert all('state' in breaker for breaker in shown.json.values())
@@ -0,0 +1,35 @@
+"""Tests for http_client.py."""
+
+import pytest
+import requests
+
+from ckanext.ndpcatalogadditions.http_client import HttpClient
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_idempotent_calls_are_retried(monkeypatch):
+    client = HttpClient(max_retries=2, backoff_factor=0)
+    responses = [FakeResponse(503), FakeResponse(200)]
+    monkeypatch.setattr(client.session, 'request', lambda *args, **kwargs: responses.pop(0))
+
+    assert client.get('http://ckan/api/3/action/user_show').status_code == 200
+    assert not responses
+
+
+def test_non_idempotent_calls_are_not_retried(monkeypatch):
+    client = HttpClient(max_retries=2, backoff_factor=0)
+    calls = []
+
+    def fake_request(*args, **kwargs):
+        calls.append(kwargs['timeout'])
+        raise requests.ConnectionError('down')
+
+    monkeypatch.setattr(client.session, 'request', fake_request)
+
+    with pytest.raises(requests.ConnectionError):
+        client.post('http://ckan/api/3/action/package_create')
+    assert calls == [client.timeout]
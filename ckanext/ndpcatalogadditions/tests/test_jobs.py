@@ -0,0 +1,95 @@
+"""Tests for jobs.py."""
+
+import pytest
+
+import ckan.model as model
+
+import ckanext.ndpcatalogadditions.jobs as jobs
+from ckanext.ndpcatalogadditions.approval_state import ApprovalCheckpoint
+from ckanext.ndpcatalogadditions.tests.endpoints import create_local, fail_once, reviewer_headers
+
+
+def test_inprocess_queue_reports_progress(monkeypatch):
+    def fake_execute(dataset_id, status, save):
+        for step in jobs.APPROVAL_STEPS:
+            status['steps'][step] = 'done'
+        status['status'] = 'finished'
+        status['result'] = {'id': 'remote-id', 'name': dataset_id}
+
+    monkeypatch.setattr(jobs, 'execute_approval', fake_execute)
+    queue = jobs.InProcessJobQueue(workers=1)
+    monkeypatch.setattr(jobs.model.Session, 'remove', lambda: None, raising=False)
+
+    job_id = queue.enqueue('my-dataset')
+    queue.executor.shutdown(wait=True)
+    status = queue.status(job_id)
+
+    assert status['job_id'] == job_id
+    assert status['status'] == 'finished'
+    assert set(status['steps'].values()) == {'done'}
+
+
+def test_inprocess_queue_unknown_job():
+    assert jobs.InProcessJobQueue(workers=1).status('missing') is None
+
+
+@pytest.fixture
+def inprocess_queue(monkeypatch):
+    queue = jobs.InProcessJobQueue(workers=1)
+    monkeypatch.setattr(jobs, '_approval_queue', queue)
+    yield queue
+    queue.executor.shutdown(wait=True)
+
+
+def approve_in_background(app, keycloak, queue, dataset_id):
+    """Queue an approval through the endpoint, wait for the worker and return its reported status."""
+    response = app.post('/ndp/package_approve', json={'id': dataset_id, 'async': True},
+                        headers=reviewer_headers(keycloak))
+    assert response.status_code == 202, response.get_data(as_text=True)
+    job_id = response.json['job_id']
+    queue.executor.submit(lambda: None).result(timeout=60)
+    response = app.get(f'/ndp/approval_status?job_id={job_id}', headers=reviewer_headers(keycloak))
+    assert response.status_code == 200
+    return response.json
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_queued_approval_runs_on_the_worker_and_checkpoints_every_step(app, stubs, inprocess_queue):
+    production, keycloak = stubs
+    dataset_id = create_local(app, keycloak, 'queued')
+
+    status = approve_in_background(app, keycloak, inprocess_queue, dataset_id)
+
+    assert status['status'] == 'finished', status['error']
+    assert set(status['steps'].values()) == {'done'}
+    [remote] = production.datasets.values()
+    assert status['result'] == {'id': remote['id'], 'name': remote['name']}
+    model.Session.remove()
+    checkpoint = ApprovalCheckpoint.load(dataset_id)
+    assert checkpoint.state == 'local_dataset_deleted'
+    assert checkpoint.data['remote_dataset_id'] == remote['id']
+    assert model.Package.get(dataset_id).state == 'deleted'
+
+
+@pytest.mark.ckan_config("ckan.plugins", "ndpcatalogadditions")
+@pytest.mark.usefixtures("with_plugins", "approval_state", "clean_index")
+def test_failed_queued_approval_is_reported_and_resumed_by_the_next_job(app, stubs, inprocess_queue, monkeypatch):
+    production, keycloak = stubs
+    dataset_id = create_local(app, keycloak, 'queued-twice')
+    fail_once(monkeypatch, 'delete_approved_dataset')
+
+    failed = approve_in_background(app, keycloak, inprocess_queue, dataset_id)
+
+    assert failed['status'] == 'failed' and 'delete_approved_dataset failed' in failed['error']
+    assert failed['steps']['remote_dataset_created'] == 'done'
+    assert failed['steps']['local_dataset_deleted'] == 'pending'
+    model.Session.remove()
+    assert ApprovalCheckpoint.load(dataset_id).state == 'remote_dataset_created'
+
+    retried = approve_in_background(app, keycloak, inprocess_queue, dataset_id)
+
+    assert retried['status'] == 'finished', retried['error']
+    assert production.action_calls('package_create') == 1
+    model.Session.remove()
+    assert ApprovalCheckpoint.load(dataset_id).state == 'local_dataset_deleted'
@@ -0,0 +1,115 @@
+"""Tests for keycloak_token.py."""
+
+import time
+
+import pytest
+
+import ckanext.ndpcatalogadditions.keycloak_token as keycloak_token
+from ckanext.ndpcatalogadditions.cache import RedisCache
+from ckanext.ndpcatalogadditions.metrics import registry
+
+
+class FakeResponse:
+    def __init__(self, keys):
+        self._keys = keys
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'keys': self._keys}
+
+
+def test_jwks_store_fetches_once_for_known_kid(monkeypatch):
+    calls = []
+
+    def fake_get(url, timeout=None):
+        calls.append(url)
+        return FakeResponse([{'kid': 'a'}])
+
+    monkeypatch.setattr(keycloak_token.requests, 'get', fake_get)
+    store = keycloak_token.JwksStore('http://keycloak/certs', min_refetch_interval=0)
+    monkeypatch.setattr(store, 'start_refresher', lambda: None)
+
+    assert store.get_key('a') == {'kid': 'a'}
+    assert store.get_key('a') == {'kid': 'a'}
+    assert len(calls) == 1
+
+
+def test_jwks_store_refetches_on_unknown_kid(monkeypatch):
+    responses = [[{'kid': 'a'}], [{'kid': 'a'}, {'kid': 'b'}]]
+    monkeypatch.setattr(keycloak_token.requests, 'get',
+                        lambda url, timeout=None: FakeResponse(responses.pop(0)))
+    store = keycloak_token.JwksStore('http://keycloak/certs', min_refetch_interval=0)
+    monkeypatch.setattr(store, 'start_refresher', lambda: None)
+
+    assert store.get_key('a') == {'kid': 'a'}
+    assert store.get_key('b') == {'kid': 'b'}
+    assert store.fetch_count == 2
+
+
+def test_jwks_store_keeps_last_good_keys_when_keycloak_is_down(monkeypatch):
+    def fake_get(url, timeout=None):
+        raise keycloak_token.requests.ConnectionError('down')
+
+    store = keycloak_token.JwksStore('http://keycloak/certs', ttl=0, min_refetch_interval=0)
+    monkeypatch.setattr(store, 'start_refresher', lambda: None)
+    monkeypatch.setattr(keycloak_token.requests, 'get',
+                        lambda url, timeout=None: FakeResponse([{'kid': 'a'}]))
+    store.get_key('a')
+
+    monkeypatch.setattr(keycloak_token.requests, 'get', fake_get)
+    store.refresh(force=True)
+    assert store.get_key('a') == {'kid': 'a'}
+
+
+def test_token_cache_returns_user_info_until_exp():
+    cache = keycloak_token.TokenCache(maxsize=2)
+    cache.set('token', {'username': 'alice'}, time.time() + 60)
+    cache.set('expired', {'username': 'bob'}, time.time() - 1)
+
+    assert cache.get('token') == {'username': 'alice'}
+    assert cache.get('expired') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_token_cache_lookups_are_exported_as_counters(monkeypatch):
+    cache = keycloak_token.TokenCache(maxsize=2)
+    monkeypatch.setattr(keycloak_token, 'token_cache', cache)
+    cache.set('token', {'username': 'alice'}, time.time() + 60)
+    cache.get('token')
+    cache.get('token')
+    cache.get('unknown')
+
+    text = registry.render()
+
+    assert '# TYPE ndp_token_cache_lookups_total counter' in text
+    assert 'ndp_token_cache_lookups_total{result="hit"} 2' in text
+    assert 'ndp_token_cache_lookups_total{result="miss"} 1' in text
+    assert 'ndp_token_cache_entries 1' in text
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = keycloak_token.TokenCache(maxsize=2)
+    exp = time.time() + 60
+    cache.set('a', {'username': 'a'}, exp)
+    cache.set('b', {'username': 'b'}, exp)
+    cache.get('a')
+    cache.set('c', {'username': 'c'}, exp)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == {'username': 'a'}
+    assert cache.get('c') == {'username': 'c'}
+
+
+def test_token_cache_finds_tokens_verified_by_another_worker():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    worker_a = keycloak_token.TokenCache(shared=RedisCache(fakeredis.FakeRedis(server=server), 'tokens'))
+    worker_b = keycloak_token.TokenCache(shared=RedisCache(fakeredis.FakeRedis(server=server), 'tokens'))
+
+    worker_a.set('token', {'username': 'alice'}, time.time() + 60)
+
+    assert worker_b.get('token') == {'username': 'alice'}
+    assert worker_b.stats()['size'] == 1
@@ -0,0 +1,65 @@
+"""Tests for metrics.py."""
+
+import time
+
+import pytest
+
+from ckanext.ndpcatalogadditions.metrics import Registry, timed
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram('ndp_test_seconds', 'Test latency.', ('endpoint',), buckets=(0.1, 1))
+    histogram.observe(0.05, 'approve')
+    histogram.observe(0.5, 'approve')
+    histogram.observe(5, 'approve')
+
+    text = registry.render()
+
+    assert '# TYPE ndp_test_seconds histogram' in text
+    assert 'ndp_test_seconds_bucket{endpoint="approve",le="0.1"} 1' in text
+    assert 'ndp_test_seconds_bucket{endpoint="approve",le="1"} 2' in text
+    assert 'ndp_test_seconds_bucket{endpoint="approve",le="+Inf"} 3' in text
+    assert 'ndp_test_seconds_sum{endpoint="approve"} 5.55' in text
+    assert 'ndp_test_seconds_count{endpoint="approve"} 3' in text
+
+
+def test_counter_escapes_label_values():
+    registry = Registry()
+    counter = registry.counter('ndp_test_total', 'Test counter.', ('action',))
+    counter.inc('say "hi"')
+    counter.inc('say "hi"', amount=2)
+
+    assert 'ndp_test_total{action="say \\"hi\\""} 3' in registry.render()
+
+
+def test_gauge_reads_its_values_at_render_time():
+    registry = Registry()
+    values = {}
+    registry.gauge('ndp_test_open', 'Test gauge.', lambda: dict(values), ('upstream',))
+    values[('keycloak',)] = 1
+
+    text = registry.render()
+
+    assert '# TYPE ndp_test_open gauge' in text
+    assert 'ndp_test_open{upstream="keycloak"} 1' in text
+
+
+def test_timed_observes_failing_blocks():
+    registry = Registry()
+    histogram = registry.histogram('ndp_test_seconds', 'Test latency.', ('phase',))
+
+    with pytest.raises(RuntimeError):
+        with timed(histogram, 'token_verification'):
+            raise RuntimeError('boom')
+
+    assert histogram.count('token_verification') == 1
+
+
+def test_observe_overhead_is_in_microseconds():
+    histogram = Registry().histogram('ndp_test_seconds', 'Test latency.', ('phase',))
+    n = 10000
+    start = time.perf_counter()
+    for _ in range(n):
+        histogram.observe(0.01, 'token_verification')
+    assert (time.perf_counter() - start) / n < 50e-6
@@ -0,0 +1,77 @@
+"""Tests for reconcile.py."""
+
+from ckanext.ndpcatalogadditions.http_client import HttpClient
+from ckanext.ndpcatalogadditions.reconcile import index_document, iter_remote, metadata_hash, reconcile
+from ckanext.ndpcatalogadditions.tests.stub_ckan import StubCkan
+
+
+def document(name, **fields):
+    return dict({'id': f'id-{name}', 'name': name, 'title': name.title(), 'organization': 'org'}, **fields)
+
+
+def test_metadata_hash_ignores_ids_empty_fields_and_tag_order():
+    local = document('a', tags=['x', 'y'], notes='')
+    remote = dict(document('a', tags=['y', 'x']), id='another-id')
+
+    assert metadata_hash(local) == metadata_hash(remote)
+    assert metadata_hash(local) != metadata_hash(document('a', title='Changed'))
+
+
+def test_metadata_hash_compares_uploaded_files_by_name():
+    local = document('a', res_url=['https://prekan.example.org/dataset/p1/resource/r1/download/data.csv',
+                                   'https://example.org/external.csv'])
+    remote = document('a', res_url=['https://ckan.example.org/dataset/d9/resource/r9/download/data.csv',
+                                    'https://example.org/external.csv'])
+    renamed = document('a', res_url=['https://ckan.example.org/dataset/d9/resource/r9/download/other.csv',
+                                     'https://example.org/external.csv'])
+
+    assert metadata_hash(local) == metadata_hash(remote)
+    assert metadata_hash(local) != metadata_hash(renamed)
+
+
+def test_reconcile_reports_missing_extra_and_changed():
+    local = [document('a'), document('b'), document('c', title='Local'), document('e')]
+    remote = [document('b'), document('c', title='Remote'), document('d')]
+
+    statuses = [(status, (l or r)['name']) for status, l, r in reconcile(local, remote)]
+
+    assert statuses == [('missing', 'a'), ('same', 'b'), ('changed', 'c'), ('extra', 'd'), ('missing', 'e')]
+
+
+def test_iter_remote_pages_through_the_catalog_by_name():
+    with StubCkan() as ckan:
+        for name in ['d', 'b', 'e', 'a', 'c']:
+            ckan.datasets[f'id-{name}'] = document(name, resources=[])
+        client = HttpClient()
+
+        names = [d['name'] for d in iter_remote(client, ckan.url, rows=2)]
+
+        assert names == ['a', 'b', 'c', 'd', 'e']
+        # three pages: a-b, c-d, e
+        assert ckan.action_calls('package_search') == 3
+        client.close()
+
+
+def test_iter_remote_requests_only_the_compared_fields():
+    with StubCkan() as ckan:
+        ckan.datasets['id-a'] = document('a', resources=[{'id': 'r1'}], creator_user_id='u1')
+        client = HttpClient()
+
+        (remote,) = iter_remote(client, ckan.url)
+
+        assert 'resources' not in remote and 'creator_user_id' not in remote
+        client.close()
+
+
+def test_index_document_matches_the_search_index_fields():
+    package = {'id': 'p1', 'name': 'a', 'title': 'A', 'private': True, 'organization': {'name': 'org'},
+               'tags': [{'name': 'x'}], 'resources': [{'name': 'data', 'url': 'https://example.org/a.csv'},
+                                                      {'name': 'more', 'format': 'CSV', 'url': ''}]}
+
+    document = index_document(package)
+
+    assert document['organization'] == 'org' and document['capacity'] == 'private'
+    assert document['tags'] == ['x']
+    assert document['res_name'] == ['data', 'more']
+    assert document['res_format'] == ['', 'CSV']
+    assert metadata_hash(document) == metadata_hash(dict(document, id='remote-id'))
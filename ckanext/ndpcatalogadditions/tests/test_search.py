@@ -0,0 +1,76 @@
+"""Tests for search.py."""
+
+import threading
+
+import pytest
+
+from ckanext.ndpcatalogadditions import search
+
+
+def test_cursor_round_trip():
+    cursor = search.encode_cursor('2024-05-01T10:00:00.123456', 'abc')
+    assert search.decode_cursor(cursor) == ('2024-05-01T10:00:00.123456', 'abc')
+
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        search.decode_cursor('not-a-cursor')
+
+
+def test_keyset_filter_descending():
+    cursor = search.encode_cursor('2024-05-01T10:00:00', 'abc')
+    assert search.keyset_filter(cursor, 'metadata_created') == (
+        'metadata_created:[* TO "2024-05-01T10:00:00Z"} OR '
+        '(metadata_created:"2024-05-01T10:00:00Z" AND id:{* TO "abc"})'
+    )
+
+
+def test_keyset_filter_ascending_on_name():
+    cursor = search.encode_cursor('dataset-a', 'abc')
+    assert search.keyset_filter(cursor, 'name', descending=False) == (
+        'name:{"dataset-a" TO *] OR '
+        '(name:"dataset-a" AND id:{"abc" TO *})'
+    )
+
+
+def test_search_page_counts_every_match_on_later_pages(monkeypatch):
+    documents = [{'id': f'id-{i}', 'name': f'd{i}'} for i in range(5)]
+    calls = []
+
+    def package_search(context, search_dict):
+        calls.append(search_dict)
+        matches = documents
+        if 'fq' in search_dict:
+            # the keyset filter of a cursor after the second document
+            matches = documents[2:]
+        return {'count': len(matches), 'results': matches[:search_dict['rows']]}
+    monkeypatch.setattr(search.logic, 'get_action', lambda name: package_search, raising=False)
+
+    first = search.search_page({}, {'q': '*:*'}, 2, sort_field='name', descending=False)
+    second = search.search_page({}, {'q': '*:*'}, 2, first['next_cursor'], sort_field='name', descending=False)
+
+    assert first['count'] == second['count'] == 5
+    assert [d['name'] for d in second['results']] == ['d2', 'd3']
+    assert calls[-1] == {'q': '*:*', 'rows': 0}
+    assert search.search_page({}, {'q': '*:*'}, 2, first['next_cursor'], sort_field='name',
+                              descending=False, total=False)['count'] is None
+
+
+def test_index_notifications_are_suppressed_only_in_the_current_thread(monkeypatch):
+    notified = []
+
+    class SynchronousSearchPlugin:
+        def notify(self, entity, operation):
+            notified.append(entity)
+
+    monkeypatch.setattr(search.ckan_search, 'SynchronousSearchPlugin', SynchronousSearchPlugin)
+    plugin = SynchronousSearchPlugin()
+
+    with search.index_notifications_suppressed():
+        plugin.notify('suppressed', 'new')
+        other = threading.Thread(target=plugin.notify, args=('other thread', 'new'))
+        other.start()
+        other.join()
+    plugin.notify('after', 'new')
+
+    assert notified == ['other thread', 'after']
@@ -0,0 +1,41 @@
+"""Tests for sync.py."""
+
+from ckanext.ndpcatalogadditions import sync
+
+
+def remote_dataset(**fields):
+    dataset = {
+        'name': 'my-dataset',
+        'title': 'My dataset',
+        'notes': 'Notes',
+        'resources': [
+            {'url': 'http://example.org/a.csv', 'name': 'a'},
+            {'url': 'http://example.org/b.csv', 'name': 'b'},
+        ],
+    }
+    dataset.update(fields)
+    return dataset
+
+
+def test_unchanged_dataset_needs_no_calls():
+    dataset = remote_dataset()
+    hashes = sync.dataset_hashes(dataset, ['la', 'lb'], ['ra', 'rb'])
+
+    plan = sync.plan_sync(hashes, remote_dataset(metadata_modified='now'), ['la', 'lb'])
+
+    assert plan == {'fields': {}, 'create': [], 'update': [], 'delete': []}
+
+
+def test_plan_sync_sends_only_changes():
+    hashes = sync.dataset_hashes(remote_dataset(), ['la', 'lb'], ['ra', 'rb'])
+    dataset = remote_dataset(title='New title', resources=[
+        {'url': 'http://example.org/a2.csv', 'name': 'a'},
+        {'url': 'http://example.org/c.csv', 'name': 'c'},
+    ])
+
+    plan = sync.plan_sync(hashes, dataset, ['la', 'lc'])
+
+    assert plan['fields'] == {'title': 'New title'}
+    assert plan['update'] == [('la', 'ra', {'url': 'http://example.org/a2.csv', 'name': 'a'})]
+    assert plan['create'] == [('lc', {'url': 'http://example.org/c.csv', 'name': 'c'})]
+    assert plan['delete'] == [('lb', 'rb')]
@@ -0,0 +1,68 @@
+"""Tests for transfer.py."""
+
+import email.parser
+import hashlib
+
+import pytest
+
+from ckanext.ndpcatalogadditions import transfer
+from ckanext.ndpcatalogadditions.http_client import HttpClient
+from ckanext.ndpcatalogadditions.tests.stub_server import StubServer
+
+
+def test_stream_length_matches_body(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'x' * 10000)
+    stream = transfer.MultipartFileStream(str(path), 'data.bin', {'id': 'r1'}, chunk_size=1000)
+
+    body = b''
+    while True:
+        data = stream.read(777)
+        if not data:
+            break
+        body += data
+
+    assert len(body) == len(stream)
+    assert stream.checksum == 'sha256:' + hashlib.sha256(b'x' * 10000).hexdigest()
+
+
+def test_upload_resource_file_to_stub_ckan(tmp_path):
+    content = b'a,b\n1,2\n' * 1000
+    path = tmp_path / 'data.csv'
+    path.write_bytes(content)
+    received = {}
+
+    def resource_patch(method, path, body):
+        header = f"Content-Type: {received['content_type']}\r\n\r\n".encode('utf-8')
+        message = email.parser.BytesParser().parsebytes(header + body)
+        form = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                for part in message.get_payload()}
+        received['file'] = form['upload']
+        return 200, {'success': True, 'result': {
+            'id': form['id'].decode(), 'size': len(form['upload']), 'hash': form['hash'].decode()}}
+
+    with StubServer({'/api/3/action/resource_patch': resource_patch}) as stub:
+        client = HttpClient(max_retries=0)
+        original_send = client.session.request
+
+        def capture(method, url, **kwargs):
+            received['content_type'] = kwargs['headers']['Content-Type']
+            return original_send(method, url, **kwargs)
+
+        client.session.request = capture
+        results = transfer.transfer_files(client, stub.url, [('l1', 'r1', str(path), 'data.csv', None)])
+
+    assert received['file'] == content
+    assert results['l1']['checksum'] == 'sha256:' + hashlib.sha256(content).hexdigest()
+
+
+def test_upload_rejects_size_mismatch(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_bytes(b'123')
+
+    def resource_patch(method, path, body):
+        return 200, {'success': True, 'result': {'id': 'r1', 'size': 1}}
+
+    with StubServer({'/api/3/action/resource_patch': resource_patch}) as stub:
+        with pytest.raises(transfer.ChecksumMismatch):
+            transfer.upload_resource_file(HttpClient(max_retries=0), stub.url, 'r1', str(path), 'data.csv')
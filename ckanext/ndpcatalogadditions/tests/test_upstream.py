@@ -0,0 +1,99 @@
+"""Tests for upstream.py."""
+
+import pytest
+
+from ckanext.ndpcatalogadditions import upstream
+from ckanext.ndpcatalogadditions.http_client import HttpClient
+from ckanext.ndpcatalogadditions.metrics import registry
+from ckanext.ndpcatalogadditions.tests.stub_server import StubServer
+
+
+def ok(method, path, body):
+    return 200, {'success': True, 'result': {}}
+
+
+def test_breaker_opens_after_failures_and_fails_fast():
+    breaker = upstream.CircuitBreaker('stub', failure_threshold=2, recovery_timeout=60)
+    client = HttpClient(breaker=breaker, max_retries=0)
+    with StubServer({'/api/3/action/status_show': ok}, error_status=500) as stub:
+        url = f'{stub.url}/api/3/action/status_show'
+        client.get(url)
+        client.get(url)
+        assert breaker.state == upstream.OPEN
+
+        with pytest.raises(upstream.CircuitOpenError):
+            client.get(url)
+        assert len(stub.requests) == 2
+        assert breaker.metrics()['rejected'] == 1
+
+
+def test_breaker_closes_after_successful_trial_call():
+    breaker = upstream.CircuitBreaker('stub', failure_threshold=1, recovery_timeout=0)
+    client = HttpClient(breaker=breaker, max_retries=0)
+    with StubServer({'/api/3/action/status_show': ok}, error_status=503) as stub:
+        url = f'{stub.url}/api/3/action/status_show'
+        client.get(url)
+        assert breaker.state == upstream.OPEN
+
+        stub.error_status = None
+        assert client.get(url).status_code == 200
+        assert breaker.state == upstream.CLOSED
+
+
+def test_deadline_bounds_slow_upstream():
+    client = HttpClient(max_retries=0)
+    with StubServer({'/api/3/action/status_show': ok}, latency=1) as stub:
+        with upstream.deadline(0.2):
+            with pytest.raises(upstream.DeadlineExceeded):
+                client.get(f'{stub.url}/api/3/action/status_show')
+
+
+def test_deadline_splits_budget_across_steps():
+    budget = upstream.Deadline(9, steps=3)
+    budget.start_step()
+    assert 2.5 < budget.timeout() <= 3
+
+
+def test_expired_deadline_does_not_block_the_half_open_breaker():
+    breaker = upstream.CircuitBreaker('stub', failure_threshold=1, recovery_timeout=0)
+    client = HttpClient(breaker=breaker, max_retries=0)
+    with StubServer({'/api/3/action/status_show': ok}, error_status=503) as stub:
+        url = f'{stub.url}/api/3/action/status_show'
+        client.get(url)
+        assert breaker.state == upstream.OPEN
+
+        stub.error_status = None
+        with upstream.deadline(0):
+            with pytest.raises(upstream.DeadlineExceeded):
+                client.get(url)
+
+        assert client.get(url).status_code == 200
+        assert breaker.state == upstream.CLOSED
+
+
+def test_unexpected_error_releases_the_trial_call():
+    breaker = upstream.CircuitBreaker('stub', failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    client = HttpClient(breaker=breaker, max_retries=0)
+
+    with pytest.raises(Exception):
+        client.get('http://[invalid')
+
+    assert not breaker.trial_in_flight
+    breaker.before_call()
+
+
+def test_breaker_state_is_exported_as_gauges(monkeypatch):
+    breaker = upstream.CircuitBreaker('gauged', failure_threshold=1, recovery_timeout=60)
+    monkeypatch.setitem(upstream._breakers, 'gauged', breaker)
+    breaker.record_failure()
+    with pytest.raises(upstream.CircuitOpenError):
+        breaker.before_call()
+
+    text = registry.render()
+
+    assert 'ndp_upstream_breaker_state{upstream="gauged",state="open"} 1' in text
+    assert 'ndp_upstream_breaker_state{upstream="gauged",state="closed"} 0' in text
+    assert 'ndp_upstream_breaker_consecutive_failures{upstream="gauged"} 1' in text
+    assert 'ndp_upstream_breaker_times_opened{upstream="gauged"} 1' in text
+    assert 'ndp_upstream_breaker_rejected_calls{upstream="gauged"} 1' in text
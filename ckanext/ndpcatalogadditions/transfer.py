@@ -0,0 +1,162 @@
+import concurrent.futures
+import hashlib
+import os
+import uuid
+
+
+chunk_size = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__TRANSFER_CHUNK_SIZE', str(1024 * 1024)))
+transfer_workers = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__TRANSFER_WORKERS', '4'))
+transfer_read_timeout = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__TRANSFER_READ_TIMEOUT', '3600'))
+# download each file back from production and compare checksums
+verify_download = os.getenv('CKANEXT__NDPCATALOGADDITIONS__TRANSFER_VERIFY_DOWNLOAD', 'true').lower() in ('true', '1', 'yes')
+
+HASH_PREFIX = 'sha256:'
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+class MultipartFileStream:
+    """Read-only multipart/form-data body that streams a file from disk.
+
+    The file part is sent first and the form fields after it, so a
+    `hash` field carrying the SHA-256 of the bytes actually sent can be
+    appended once the file has been read. The body length is known up
+    front, which lets `requests` send a Content-Length and stream the body
+    in chunks instead of building it in memory.
+    """
+
+    def __init__(self, path, filename, fields, chunk_size=chunk_size):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.size = os.path.getsize(path)
+        self.sha256 = hashlib.sha256()
+        self.fields = fields
+        self._chunk = b''
+        self._offset = 0
+        self._parts = self._generate(filename)
+        # the hash field is a fixed-length hex digest, so the length can be computed now
+        epilogue = self._epilogue(HASH_PREFIX + '0' * 64)
+        self.length = len(self._preamble(filename)) + self.size + len(epilogue)
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def _preamble(self, filename):
+        return (f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="upload"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+
+    def _epilogue(self, checksum):
+        fields = dict(self.fields, hash=checksum)
+        body = ''.join(f'\r\n--{self.boundary}\r\n'
+                       f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}'
+                       for name, value in fields.items())
+        return (body + f'\r\n--{self.boundary}--\r\n').encode('utf-8')
+
+    def _generate(self, filename):
+        yield self._preamble(filename)
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.sha256.update(chunk)
+                yield chunk
+        yield self._epilogue(self.checksum)
+
+    @property
+    def checksum(self):
+        return HASH_PREFIX + self.sha256.hexdigest()
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._chunk):
+                try:
+                    self._chunk, self._offset = next(self._parts), 0
+                except StopIteration:
+                    break
+                continue
+            piece = self._chunk[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return b''.join(pieces)
+
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return HASH_PREFIX + sha256.hexdigest()
+
+
+def download_checksum(client, url):
+    sha256 = hashlib.sha256()
+    with client.session.get(url, stream=True, timeout=(client.timeout[0], transfer_read_timeout)) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            sha256.update(chunk)
+    return HASH_PREFIX + sha256.hexdigest()
+
+
+def upload_resource_file(client, ckan_url, remote_resource_id, path, filename, expected_checksum=None):
+    """Stream one local file into a production resource and verify it arrived intact.
+
+    The size production reports is compared with the bytes sent and, with
+    `verify_download` (the default), the file is downloaded back and its
+    SHA-256 compared with the one computed while sending. The `hash` field
+    sent along is only recorded by production, not checked by it.
+    """
+    stream = MultipartFileStream(path, filename, {'id': remote_resource_id})
+    response = client.post(f'{ckan_url}/api/3/action/resource_patch', data=stream,
+                           headers={'Content-Type': stream.content_type},
+                           timeout=(client.timeout[0], transfer_read_timeout))
+    if response.status_code != 200:
+        raise ValueError(f"Failed to upload {filename}: {response.text}")
+    remote_resource = response.json()['result']
+
+    checksum = stream.checksum
+    if expected_checksum and expected_checksum.startswith(HASH_PREFIX) and expected_checksum != checksum:
+        raise ChecksumMismatch(f"{filename} does not match its recorded checksum {expected_checksum}")
+    if remote_resource.get('size') not in (None, stream.size):
+        raise ChecksumMismatch(f"{filename}: sent {stream.size} bytes, production stored {remote_resource['size']}")
+    if verify_download and remote_resource.get('url'):
+        remote_checksum = download_checksum(client, remote_resource['url'])
+        if remote_checksum != checksum:
+            raise ChecksumMismatch(f"{filename}: downloaded checksum {remote_checksum}, sent {checksum}")
+    return {'checksum': checksum, 'size': stream.size, 'remote_id': remote_resource_id}
+
+
+def transfer_files(client, ckan_url, uploads, workers=transfer_workers):
+    """Upload several files with bounded concurrency.
+
+    `uploads` is a list of (local_id, remote_resource_id, path, filename,
+    expected_checksum). Returns {local_id: result} and raises the first
+    error once every upload has finished.
+    """
+    results = {}
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(upload_resource_file, client, ckan_url, remote_id, path, filename, checksum): local_id
+            for local_id, remote_id, path, filename, checksum in uploads
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
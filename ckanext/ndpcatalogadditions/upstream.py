@@ -0,0 +1,183 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from ckanext.ndp.metrics import registry
+
+
+failure_threshold = int(os.getenv('CKANEXT__NDPCATALOGADDITIONS__BREAKER_FAILURE_THRESHOLD', '5'))
+recovery_timeout = float(os.getenv('CKANEXT__NDPCATALOGADDITIONS__BREAKER_RECOVERY_TIMEOUT', '30'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream service (Keycloak, the production CKAN) can not be used right now."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker for one upstream.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    every call fails fast with CircuitOpenError. Once `recovery_timeout`
+    seconds have passed a single trial call is let through (half-open);
+    its outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=failure_threshold, recovery_timeout=recovery_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.trial_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == OPEN or (self.state == HALF_OPEN and self.trial_in_flight):
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        # the call ended without saying anything about the upstream: only free the trial slot
+        with self._lock:
+            self.trial_in_flight = False
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def metrics(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'times_opened': self.times_opened,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breaker_metrics():
+    return {name: breaker.metrics() for name, breaker in _breakers.items()}
+
+
+def _breaker_gauge(field):
+    return lambda: {(name,): breaker.metrics()[field] for name, breaker in list(_breakers.items())}
+
+
+registry.gauge(
+    'ndp_upstream_breaker_state', 'Circuit breaker state of each upstream, 1 for its current state.',
+    lambda: {(name, state): int(breaker.state == state)
+             for name, breaker in list(_breakers.items()) for state in (CLOSED, OPEN, HALF_OPEN)},
+    ('upstream', 'state'))
+registry.gauge(
+    'ndp_upstream_breaker_consecutive_failures', 'Failed calls to each upstream since its last success.',
+    _breaker_gauge('consecutive_failures'), ('upstream',))
+registry.gauge(
+    'ndp_upstream_breaker_times_opened', 'Times the circuit breaker of each upstream has opened.',
+    _breaker_gauge('times_opened'), ('upstream',))
+registry.gauge(
+    'ndp_upstream_breaker_rejected_calls', 'Calls to each upstream failed fast by its open circuit breaker.',
+    _breaker_gauge('rejected'), ('upstream',))
+
+
+class Deadline:
+    """Time budget for one request, shared out across its remote steps.
+
+    Each call to `start_step` gives the next step an equal share of what is
+    left, so a fast step leaves more time for the ones after it.
+    """
+
+    def __init__(self, budget, steps=1):
+        self.expires_at = time.monotonic() + budget
+        self.steps_left = max(steps, 1)
+        self.step_expires_at = self.expires_at
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def start_step(self):
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        self.step_expires_at = time.monotonic() + remaining / self.steps_left
+        self.steps_left = max(self.steps_left - 1, 1)
+
+    def timeout(self):
+        """Seconds the current remote call may take."""
+        remaining = min(self.step_expires_at, self.expires_at) - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return remaining
+
+
+_current_deadline = contextvars.ContextVar('ndp_deadline', default=None)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+@contextlib.contextmanager
+def deadline(budget, steps=1):
+    token = _current_deadline.set(Deadline(budget, steps))
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)